@@ -18,18 +18,56 @@ TO DO:
 
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import copy
 import math
+import time
 import pygame
 import datetime
 import json
+import os
 
 from collections import deque
 
 import cv2 as cv
-import mediapipe as mp
-
-def main():
+import numpy as np
+
+from capture import CAPTURE_FPS, PIXEL_FORMATS, PLATFORM_BACKENDS, open_camera
+from engine import (CALIBRATE, CALIBRATED, CALIBRATION_MODE, END, ENDED_MODE, FLASH, KEY_FRAMES, LEVEL_SELECT,
+                    LEVEL_SELECT_MODE, LOAD, LOADING_MODE, NAMING_MODE, PLAYING_MODE, RECORD, RECORD_TWO_HANDS,
+                    SEEK_BACK, SEEK_FORWARD, SETTINGS, SETTINGS_MODE, SKIP, START, START_MODE, SUBMIT, GameEngine)
+from framebuffer import FrameBuffers
+from hitmatch import FINGERTIPS, HandMatcher
+from inferencepool import InferencePool
+from latency import DEFAULT_DEVICE, DEVICES_PATH, LatencyCalibration, SongClock, load_devices
+from levelfile import load_level, save_level
+from library import LevelLibrary
+from overlay import OverlayCache
+from persistence import DEFAULT_PROFILE, BackgroundWriter, HighScoreStore
+from pipeline import HandPipeline
+from profiler import FrameProfiler
+from recorder import StreamingRecorder
+from setlist import Setlist
+from songmeta import SongMetadata
+from startup import StartupTasks, load_sounds
+from telemetry import TELEMETRY_PATH, TelemetryRecorder, telemetry_name
+from tracking import FRAME_BUDGET_MS, MAX_STRIDE, AdaptiveHands
+from trails import TargetRenderer
+
+# keys that only change the engine's mode
+MENU_KEYS = {
+    pygame.K_z : SETTINGS,
+    pygame.K_q : RECORD,
+    pygame.K_w : RECORD_TWO_HANDS,
+    pygame.K_e : KEY_FRAMES,
+    pygame.K_c : CALIBRATE,
+    pygame.K_LEFT : SEEK_BACK,
+    pygame.K_RIGHT : SEEK_FORWARD
+}
+
+def main(level_name="default.hdlevel", cap=None, hands=None, music=None, profiler=None, quit_at_end=False, save=True, timer=None,
+         setlist=None):
+    # cap, hands and music default to the webcam, MediaPipe and pygame.mixer.music
+    # timer is what the song clock is interpolated with, time.perf_counter unless a replay brings its own
+    # setlist is a list of level names to play back to back, instead of level_name
     running = True
     cap_width = 960
     cap_height = 540
@@ -40,111 +78,166 @@ def main():
     sfx_path = "./sfx/"
     default_song_name = "twinkle-twinkle-little-star.mp3"
     preferences_path = "preferences.json"
-    start_coords = [cap_width//2, cap_height-60]
-    pygame.mixer.init()
+    start_coords = (cap_width//2, cap_height-60)
+    song_meta = SongMetadata()
+    if music is None:
+        music = pygame.mixer.music
+    if profiler is None:
+        profiler = FrameProfiler()
+    if timer is None:
+        timer = time.perf_counter
+    # time to first frame is measured from here
+    startup = StartupTasks()
 
     try:
         with open(preferences_path, "r") as f:
             load_preferences = json.load(f)
-            
-            try:
-                high_score = load_preferences["default.hdlevel_high_score"]
-            except:
-                high_score = 0
     except:
         load_preferences = {
             "hit_tolerance" : 50,
-            "hit_interval" : 30,
+            "hit_window" : 1000,
             "no_camera" : True,
-            "default.hdlevel_high_score" : 0
+            "pipelined" : False
         }
     
+    # nothing is written from the frame loop, preferences, scores and levels go through the writer thread
+    writer = BackgroundWriter()
+    scores = HighScoreStore(writer, profile=load_preferences.get("profile", DEFAULT_PROFILE))
+    if save:
+        # scores from preference files written before scores.db
+        scores.import_scores({key[:-len("_high_score")] : value for key, value in load_preferences.items() if key.endswith("_high_score")})
+    
     hit_tolerance = load_preferences["hit_tolerance"]
-    hit_interval = load_preferences["hit_interval"]
+    # hit_window is in milliseconds, older preference files only have hit_interval in frames (~30fps)
+    hit_window = load_preferences.get("hit_window", load_preferences.get("hit_interval", 30) * 1000 // 30)
     no_camera = load_preferences["no_camera"]
+    pipelined = load_preferences.get("pipelined", False)
+    # MediaPipe worker processes, 0 runs it in this one
+    inference_workers = load_preferences.get("inference_workers", 0)
+    # [p] toggles the performance overlay, profile_trace is where the frame timings are written on exit
+    show_profile = load_preferences.get("show_profile", False)
+    profile_trace = load_preferences.get("profile_trace")
+    lookahead = load_preferences.get("lookahead_ms", 0)
+    # pixels a two-handed pose has to move to be recorded, 0 keeps every frame
+    record_tolerance = load_preferences.get("record_tolerance", 0)
+    telemetry_enabled = load_preferences.get("telemetry", False)
+    telemetry_path = load_preferences.get("telemetry_path", TELEMETRY_PATH)
+    detection_confidence = load_preferences.get("detection_confidence", 0.7)
+    tracking_confidence = load_preferences.get("tracking_confidence", 0.5)
+    # a camera index, a video file or "synthetic"
+    camera_source = load_preferences.get("camera", 0)
+    camera_backends = load_preferences.get("camera_backends", PLATFORM_BACKENDS)
+    camera_formats = load_preferences.get("camera_formats", PIXEL_FORMATS)
+    camera_fps = load_preferences.get("camera_fps", CAPTURE_FPS)
+    adaptive_inference = None
+    if load_preferences.get("adaptive_inference", False):
+        adaptive_inference = {
+            "budget_ms" : load_preferences.get("inference_budget_ms", FRAME_BUDGET_MS),
+            "max_stride" : load_preferences.get("max_inference_stride", MAX_STRIDE),
+            "scale" : load_preferences.get("inference_scale", 1.0),
+            "roi" : load_preferences.get("inference_roi", True)
+        }
+    hit_matcher = HandMatcher(hit_tolerance, load_preferences.get("hit_landmarks", FINGERTIPS), load_preferences.get("hit_weights"))
+    # latency offsets per device, measured with [c]
+    device = load_preferences.get("device", DEFAULT_DEVICE)
+    devices = load_devices()
+    device_profile = devices.get(device, {})
+    song_clock = SongClock(music, device_profile.get("audio_offset_ms", 0), device_profile.get("camera_latency_ms", 0), timer)
+    calibration = None
+    calibration_box = (420, 180, 540, 300)
     
     
     user_text = ''
     submit_text = None
-    submit_count = 0
-    aura_time = 0
 
-    points = 0
-    combo = 0
-    
-    target_times = deque()
-    target_coords = deque()
+    # level select menu
+    library = LevelLibrary(levels_path, songs_path, song_meta, scores.all())
+    library.scan()
+    level_selection = 0
+    level_load = None
+    loading_level = None
+    level_menu_rows = 11
+    # levels played back to back
+    setlist_levels = setlist if setlist is not None else load_preferences.get("setlist")
+    setlist = None
+    if setlist_levels:
+        setlist = Setlist(setlist_levels, levels_path, songs_path, song_meta)
+        level_name = setlist.level_name()
+        setlist.prefetch(1)
+    # the take being recorded
+    recorder = None
+    telemetry = None
+    key_frame_times = []
+    key_frame_coords = []
+
+    target_renderer = TargetRenderer(cap_width, cap_height, load_preferences.get("render_budget_ms", FRAME_BUDGET_MS))
+    overlay = OverlayCache(cap_width, cap_height)
+
+    scrn = pygame.display.set_mode((cap_width, cap_height))
+    buffers = FrameBuffers(cap_width, cap_height)
+
+    # Startup #############################################################
+    if cap is None:
+        camera = startup.add("camera", open_camera, camera_source, cap_width, cap_height, camera_fps, camera_backends, camera_formats)
+    else:
+        camera = startup.add("camera", lambda: (cap, None))
+    pipeline = None
+    if hands is None:
+        startup.add("hand model", load_hands, camera, cap_width, cap_height, inference_workers, pipelined,
+                    detection_confidence, tracking_confidence, adaptive_inference)
+    if setlist is not None:
+        # (song name, times, coords, song file)
+        startup.add("level", setlist.load, 0)
+    else:
+        startup.add("level", load_level, levels_path + level_name)
+    pygame.mixer.init()
+    startup.add("sounds", load_sounds, sfx_path)
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+        debug_image = buffers.start_display(False)
+        debug_image = overlay.draw(debug_image, draw_loading, startup.progress())
+        scrn.blit(buffers.surface(debug_image), (0,0))
+        pygame.display.flip()
+        startup.first_frame()
+        # quitting still waits for the tasks, so whatever they opened is closed below
+        if startup.done() or not running:
+            break
+        startup.wait()
+
+    cap, camera_mode = startup.result("camera")
+    if camera_mode is not None:
+        print("camera:", camera_mode)
+    if hands is None:
+        pipeline, hands = startup.result("hand model")
+    sounds = startup.result("sounds")
     try:
-        level_name = "default.hdlevel"
-        with open(levels_path + level_name, "r") as f:
-            load_recording = json.load(f)
-            song_name = load_recording["songname"]
-            recorded_coords = deque(load_recording["coords"])
-            recorded_times = deque(load_recording["times"])
-            pygame.mixer.music.load(songs_path + song_name)
+        song_name, recorded_times, recorded_coords = startup.result("level")[:3]
+        music.load(songs_path + song_name)
+        if setlist is not None:
+            level_name = setlist.level_name()
     except:
         recorded_coords = deque()
         recorded_times = deque()
         song_name = default_song_name
         level_name = ""
-        pygame.mixer.music.load(songs_path + song_name)
-    song_length = int(pygame.mixer.Sound(songs_path + song_name).get_length())
-    song_length = datetime.time(minute=(song_length//60), second=(song_length%60)).strftime("%M:%S")
-    show_target = False
-    show_start_screen = True
-    show_end_screen = False
-    is_recording = False
-    recording_mode = False
-    two_handed_mode = False
-    key_frame_mode = False
-    playback_mode = True
-    play_end_sound = True
-    input_mode = False
-    settings_mode = False
-    written_end = False
-
-    # Camera preparation ###############################################################
-    cap = cv.VideoCapture(0, cv.CAP_DSHOW)
-    cap.set(cv.CAP_PROP_FRAME_WIDTH, cap_width)
-    cap.set(cv.CAP_PROP_FRAME_HEIGHT, cap_height)
-
-    # Model load #############################################################
-    mp_hands = mp.solutions.hands
-    hands = mp_hands.Hands(
-        max_num_hands=2,
-        min_detection_confidence=0.7,
-        min_tracking_confidence=0.5,
-    )
+        music.load(songs_path + song_name)
+    high_score = scores.get(level_name)
+    # engine.start_ms is where in the song playback begins, the song clock adds it to get_pos() once playing
+    engine = GameEngine(recorded_times, recorded_coords, hit_window, hit_matcher, lookahead, song_clock.camera_latency_ms, no_camera)
+    startup.ready()
+    print("startup:", startup.stats())
 
     while running:
-        # Camera capture #####################################################
-        ret, image = cap.read()
-        if not ret:
-            break
-        image = cv.resize(image, (cap_width, cap_height))
-        image = cv.flip(image, 1)  # Mirror display
-        debug_image = copy.deepcopy(image)
-
-        # remove camera feed if in settings
-        if no_camera or input_mode:
-            debug_image[:] = (0, 0, 0)
-
-        if input_mode:
-            debug_image = draw_message(debug_image, "Press [enter] to submit", (600, cap_height-30))
-
-        # Detection implementation #############################################################
-        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
-
-        image.flags.writeable = False
-        results = hands.process(image)
-        image.flags.writeable = True
-        
         key = 0
+        # game events for the engine this frame
+        inputs = set()
 
         # reset typed text
-        if input_mode:
-            submit_text = None
-        else:
+        submit_text = None
+        if not engine.typing:
             user_text = ''
 
         # process key input
@@ -152,399 +245,487 @@ def main():
             if event.type == pygame.QUIT:
                 running = False
             if event.type == pygame.KEYDOWN:
-                if input_mode:
+                if engine.typing:
                     if event.key == pygame.K_BACKSPACE:
                         user_text = user_text[:-1]
                     elif event.key == pygame.K_RETURN:
                         submit_text = user_text
-                        submit_count += 1
-                        input_mode = False
+                        user_text = ''
                     elif ((event.key >= pygame.K_a and event.key <= pygame.K_z) or (event.key >= pygame.K_0 and event.key <= pygame.K_9)
                                 or event.key == pygame.K_MINUS or event.key == pygame.K_PERIOD or event.key == pygame.K_UNDERSCORE):
                         user_text += event.unicode
                 else:
                     key = event.key
+                    # when the key was seen, before this frame is read and inferred, for calibration taps
+                    key_ms = timer() * 1000
+
+        # after the key poll, so the read stage is only the camera wait
+        profiler.start_frame()
+        # Camera capture #####################################################
+        if pipeline is not None:
+            frame = pipeline.read()
+            if frame is None:
+                break
+            image, results = frame
+            profiler.mark("read")
+        else:
+            ret, image = buffers.read(cap)
+            if not ret:
+                break
+            profiler.mark("read")
+            if isinstance(hands, AdaptiveHands):
+                hands.wait(profiler.stage_ms("read"))
+            image = buffers.load(image)  # Mirror display
+
+        # remove camera feed if in settings
+        if pipeline is not None and not (engine.no_camera or engine.typing):
+            # pipelined frames aren't reused until the next read, so they can be drawn on directly
+            debug_image = image
+        else:
+            debug_image = buffers.start_display(not (engine.no_camera or engine.typing))
+
+        if engine.typing:
+            debug_image = overlay.draw(debug_image, draw_message, "Press [enter] to submit", (600, cap_height-30))
+        profiler.mark("prepare")
+
+        # Detection implementation #############################################################
+        if pipeline is None:
+            image = buffers.rgb_frame()
+
+            image.flags.writeable = False
+            results = hands.process(image)
+            image.flags.writeable = True
+        profiler.mark("inference")
         
         # exit on escape
         if key == pygame.K_ESCAPE:  # ESC
             break
 
+        if key == pygame.K_p: # p, performance overlay
+            show_profile = not show_profile
+
+        if key in MENU_KEYS:
+            inputs.add(MENU_KEYS[key])
+
         # resets important variables - keeps level the same
         if key == pygame.K_r: # r to restart
-            pygame.mixer.music.stop()
-            pygame.mixer.Sound(sfx_path + "applause.wav").stop()
-            # convoluted way to load recorded targets so that levels can be immediately played several times after recorded
-            if recording_mode or key_frame_mode:
-                load_recording["coords"] = list(recorded_coords)
-                load_recording["times"] = list(recorded_times)
-            recorded_coords = deque(load_recording["coords"])
-            recorded_times = deque(load_recording["times"])
+            music.stop()
+            sounds.stop("applause.wav")
+            # recorded targets stay loaded so that levels can be immediately played several times after recorded
+            if engine.recording or engine.key_frames:
+                recorded_coords = list(recorded_coords)
+                recorded_times = list(recorded_times)
+            if recorder is not None:
+                recorder.discard()
+                recorder = None
+            if telemetry is not None:
+                telemetry.close()
+                telemetry = None
+            engine.reset(recorded_times, recorded_coords)
+            song_clock.start(0)
             user_text = ''
-            submit_text = None
-            submit_count = 0
-            aura_time = 0
-            points = 0
-            combo = 0
-            target_times = deque()
-            target_coords = deque()
-            show_target = False
-            show_start_screen = True
-            show_end_screen = False
-            is_recording = False
-            recording_mode = False
-            two_handed_mode = False
-            key_frame_mode = False
-            playback_mode = True
-            play_end_sound = True
-            input_mode = False
-            settings_mode = False
-            written_end = False
-        
-        # enter settings mode
-        if key == pygame.K_z and show_start_screen and not recording_mode: # z, change settings
-            show_start_screen = False
-            settings_mode = True
-            input_mode = True
-
-        # draw settings mode
-        if settings_mode:
-            debug_image = draw_message(debug_image, "CURRENT SETTINGS")
-            debug_image = draw_message(debug_image, "Number of frames target appears - " + str(hit_interval), (10, 150))
-            debug_image = draw_message(debug_image, "Distance to hit target - " + str(hit_tolerance), (10, 180))
-            debug_image = draw_message(debug_image, "Show Camera - " + ("OFF" if no_camera else "ON"), (10, 210))
-            if submit_count == 0:
-                debug_image = draw_message(debug_image, "Enter # frames target appears (or nothing to keep current):", (10, 250))
-            elif submit_count == 1:
-                debug_image = draw_message(debug_image, "Enter distance to hit target (or nothing to keep current):", (10, 250))
-                if not input_mode:
-                    user_text = ''
-                    try:
-                        temp_input = int(submit_text)
-                        hit_interval = temp_input
-                    except:
-                        print("using default")
-                    input_mode = True
-            elif submit_count == 2:
-                debug_image = draw_message(debug_image, "Toggle camera mode? [y/(N)]:", (10, 250))
-                if not input_mode:
-                    user_text = ''
-                    try:
-                        temp_input = int(submit_text)
-                        hit_tolerance = temp_input
-                    except:
-                        print("using default")
-                    input_mode = True
-            elif submit_count == 3:
-                if not input_mode:
-                    if submit_text == "y":
-                        no_camera = not no_camera
-                
-                preferences_save = load_preferences
-                preferences_save["hit_interval"] = hit_interval
-                preferences_save["hit_tolerance"] = hit_tolerance
-                preferences_save["no_camera"] = no_camera
-
-                try:
-                    with open(preferences_path, "w") as json_file:
-                        json.dump(preferences_save, json_file)
-                except Exception:
-                    print("unable to write to preferences")
-
-                submit_count = 0
-                show_start_screen = True
-                settings_mode = False
-
-        if (key == pygame.K_q or key == pygame.K_w) and show_start_screen: # q or w, recording mode
-            print("entering recording mode")
-            if key == pygame.K_w: # w for two-handed
-                print("two-handed mode")
-                two_handed_mode = True
-            #print("enter song file name: ")
-            input_mode = True
-            recorded_coords = deque()
-            recorded_times = deque()
-            recording_mode = True
-            playback_mode = False
-            show_start_screen = False
-
-        if recording_mode and input_mode:
-            if submit_count == 0:
-                debug_image = draw_message(debug_image, "Enter song file name: ")
-            elif submit_count == 1:
-                debug_image = draw_message(debug_image, "Enter level name (without extension): ")
-
-        if recording_mode and submit_count > 0 and not input_mode:
-            if submit_count == 1:
-                user_text = ''
+            calibration = None
+            level_load = None
+            if setlist is not None:
+                # back to the setlist's first level
+                level_load = setlist.restart()
+                loading_level = setlist.levels[0]
+                inputs.add(LOAD)
+
+        if submit_text is not None:
+            if engine.mode == NAMING_MODE and engine.prompt == 0:
                 try:
                     song_name = submit_text
-                    pygame.mixer.music.unload()
-                    pygame.mixer.music.load(songs_path + song_name)
-                    input_mode = True
+                    music.unload()
+                    music.load(songs_path + song_name)
                 except Exception:
                     print("using default song and name user_default.hdlevel")
                     song_name = default_song_name
-                    pygame.mixer.music.load(songs_path + song_name)
+                    music.load(songs_path + song_name)
                     level_name = "user_default.hdlevel"
-                    show_start_screen = True
-                    submit_count = 0
-                song_length = int(pygame.mixer.Sound(songs_path + song_name).get_length())
-                song_length = datetime.time(minute=(song_length//60), second=(song_length%60)).strftime("%M:%S")
-            if submit_count == 2:
+                    inputs.add(SKIP)
+            elif engine.mode == NAMING_MODE:
                 level_name = submit_text + '.hdlevel'
-                show_start_screen = True
-                submit_count = 0
-
-        if key == pygame.K_s and playback_mode: # s to change level
-            show_start_screen = False
-            input_mode = True
-        
-        if playback_mode and submit_count == 0 and input_mode and not settings_mode:
-            debug_image = draw_message(debug_image, "Enter level name (without extension): ")
-
-        if playback_mode and submit_count == 1 and not input_mode and not settings_mode:
+            inputs.add((SUBMIT, submit_text))
+
+        if key == pygame.K_s and level_load is None and setlist is None: # s to change level
+            inputs.add(LEVEL_SELECT)
+
+        if engine.mode == LEVEL_SELECT_MODE:
+            levels = library.entries()
+            if len(levels) > 0:
+                if key == pygame.K_UP:
+                    level_selection -= 1
+                elif key == pygame.K_DOWN:
+                    level_selection += 1
+                level_selection = min(max(level_selection, 0), len(levels) - 1)
+                if key == pygame.K_RETURN:
+                    loading_level = levels[level_selection][0]
+                    level_load = library.load(loading_level)
+                    inputs.add(LOAD)
+
+        # the selected level is parsed on the library's thread, the game keeps running until it is ready
+        if level_load is not None and engine.mode == LOADING_MODE and level_load.done():
             try:
-                level_name = submit_text + ".hdlevel"
-                with open(levels_path + level_name, "r") as f:
-                    load_recording = json.load(f)
-                    song_name = load_recording["songname"]
-                    recorded_coords = deque(load_recording["coords"])
-                    recorded_times = deque(load_recording["times"])
-                    pygame.mixer.music.load(songs_path + song_name)
-                    try:
-                        high_score = load_preferences[level_name + "_high_score"]
-                    except:
-                        high_score = 0
+                song_name, recorded_times, recorded_coords = level_load.result()[:3]
+                music.load(songs_path + song_name)
+                # a setlist entry that couldn't be loaded was replaced by the default level
+                level_name = loading_level if setlist is None else setlist.level_name()
             except Exception:
                 print("using default")
                 try:
                     level_name = "default.hdlevel"
-                    with open(levels_path + level_name, "r") as f:
-                        load_recording = json.load(f)
-                        song_name = load_recording["songname"]
-                        recorded_coords = deque(load_recording["coords"])
-                        recorded_times = deque(load_recording["times"])
-                        pygame.mixer.music.load(songs_path + song_name)
+                    song_name, recorded_times, recorded_coords = load_level(levels_path + level_name)
+                    music.load(songs_path + song_name)
                 except IOError:
                     recorded_coords = deque()
                     recorded_times = deque()
                     song_name = default_song_name
                     level_name = ""
-                    pygame.mixer.music.load(songs_path + song_name)
-            song_length = int(pygame.mixer.Sound(songs_path + song_name).get_length())
-            song_length = datetime.time(minute=(song_length//60), second=(song_length%60)).strftime("%M:%S")
-            show_start_screen = True
-            submit_count = 0
-            
-        if key == pygame.K_e and show_start_screen: # e, key frame mode after one-handed
-            print("entering key frame mode")
-            key_frame_mode = True
-            key_frame_times = []
-            key_frame_coords = []
-        
-        if key_frame_mode:
-            debug_image = draw_mode(debug_image, "KEYFRAME MODE")
-        if recording_mode:
-            mode_desc = "RECORD MODE"
-            if two_handed_mode:
-                mode_desc += ":TWO HANDS"
-            else:
-                mode_desc += ":ONE HAND"
-            if is_recording:
-                mode_desc += ":RECORDING"
-            debug_image = draw_mode(debug_image, mode_desc)
-        
-        if key == pygame.K_a and key_frame_mode:
-            pygame.mixer.Sound(sfx_path + "menu-selection-click.wav").play()
-            aura_time = 10
+                    music.load(songs_path + song_name)
+            high_score = scores.get(level_name)
+            engine.reset(recorded_times, recorded_coords)
+            engine.seek(0)
+            level_load = None
+
+        if key == pygame.K_a and engine.key_frames:
+            sounds.play("menu-selection-click.wav")
+            inputs.add(FLASH)
             print("getting frame")
-            if (len(recorded_times) > 0) and (len(recorded_coords) > 0):
-                key_frame_times.append(recorded_times[0])
-                key_frame_coords.append(recorded_coords[0])
+            if not engine.track.scheduler.done():
+                key_frame_times.append(recorded_times[engine.track.scheduler.cursor])
+                key_frame_coords.append(recorded_coords[engine.track.scheduler.cursor])
 
-        coordmatch_count = 0
-        coordmatch_goal = 4
         left_hand = []
         right_hand = []
+        # handedness confidence, left and right
+        hand_scores = [0.0, 0.0]
+        # song_ms is what the player hears, pose_ms is when the hands seen this frame were in that pose
+        song_clock.update()
+        song_ms = song_clock.song_ms()
+        pose_ms = song_clock.pose_ms()
 
         #  ####################################################################
         if results.multi_hand_landmarks is not None:
             for hand_landmarks, handedness in zip(results.multi_hand_landmarks, results.multi_handedness):
+                hand_score = handedness.classification[0].score
                 handedness = handedness.classification[0].label[0:]
                 # Landmark calculation
                 landmark_list = calc_landmark_list(debug_image, hand_landmarks)
 
-                if (math.dist(landmark_list[8], start_coords) < hit_tolerance) and show_start_screen:
-                    pygame.mixer.music.play()
-                    show_start_screen = False
-                    if recording_mode:
-                        is_recording = True
+                # a key pressed on the same frame goes first
+                if (math.dist(landmark_list[8], start_coords) < hit_matcher.tolerance) and engine.mode == START_MODE \
+                        and key == 0 and START not in inputs:
+                    if engine.recording:
+                        music.play()
+                        song_clock.start(0)
+                        # the take is streamed to a journal next to the level while recording
+                        recorder = StreamingRecorder(levels_path + level_name, song_name, engine.recording,
+                                                     record_tolerance if engine.recording == 2 else 0)
                     else:
-                        show_target = True
-                        temp_hit_interval = hit_interval
-                        if recorded_times[-1] == -1:
-                            print("setting fluid hit_interval")
-                            hit_interval = 2
+                        music.play(start=engine.start_ms / 1000)
+                        song_clock.start(engine.start_ms)
+                    inputs.add(START)
                     
                 if (handedness == "Right"):
                     right_hand = landmark_list
+                    hand_scores[1] = hand_score
                 elif (handedness == "Left"):
                     left_hand = landmark_list
+                    hand_scores[0] = hand_score
 
                 # Drawing part
                 debug_image = draw_landmarks(debug_image, landmark_list, 1.0, (255, 255, 255))
 
-        if show_target and (not key_frame_mode) and len(target_coords) > 0 and len(right_hand) > 0:
-            if len(target_coords[0]) == 2:
-                if len(left_hand) > 0:
-                    coordmatch_goal = 8
-                    current_finger = 4
-                    while (current_finger <= 20):
-                        if (math.dist(left_hand[current_finger], target_coords[0][0][current_finger]) < hit_tolerance):
-                            coordmatch_count += 1
-                        current_finger += 4
-                    current_finger = 4
-                    while (current_finger <= 20):
-                        if (math.dist(right_hand[current_finger], target_coords[0][1][current_finger]) < hit_tolerance):
-                            coordmatch_count += 1
-                        current_finger += 4
-            else:
-                current_finger = 4
-                while (current_finger <= 20):
-                    if (math.dist(right_hand[current_finger], target_coords[0][current_finger]) < hit_tolerance):
-                        coordmatch_count += 1
-                    current_finger += 4
-            
-            
-            if coordmatch_count >= coordmatch_goal:
-                pygame.mixer.Sound(sfx_path + "menu-selection-click.wav").play()
-                aura_time = 10
-                multiplier = min(combo + 1, 10)
-                points += (100 * multiplier)
-                combo += 1
-                # target_times[0] = 0
-                target_coords.popleft()
-                target_times.popleft()
-            
+        # the hands are judged at the time they were seen, key frame mode only replays the level
+        hit_ms = pose_ms
+        hands_seen = None if engine.key_frames else (left_hand, right_hand, hit_ms)
 
-        if (key == pygame.K_a or two_handed_mode) and is_recording and (len(right_hand) > 0): # a, record keyframe
-            if not two_handed_mode or len(left_hand):
-                recorded_times.append(pygame.mixer.music.get_pos())
-                if two_handed_mode:
-                    recorded_coords.append([left_hand, right_hand])
+        if (key == pygame.K_a or engine.recording == 2) and recorder is not None and (len(right_hand) > 0): # a, record keyframe
+            if engine.recording == 1 or len(left_hand):
+                # poses are recorded at the compensated time so levels line up on every device
+                song_clock.update()
+                if engine.recording == 2:
+                    recorder.add(song_clock.pose_ms(), [left_hand, right_hand])
                 else:
-                    pygame.mixer.Sound(sfx_path + "menu-selection-click.wav").play()
-                    recorded_coords.append(right_hand)
-
-        if pygame.mixer.music.get_busy():
-            song_pos = pygame.mixer.music.get_pos()
-            if playback_mode:
-                if len(recorded_times) > 0:
-                    if recorded_times[0] < int(song_pos):
-                        target_coords.append(recorded_coords[0])
-                        target_times.append(hit_interval)
-                        recorded_coords.popleft()
-                        recorded_times.popleft()
-
-            song_pos = song_pos // 1000
+                    sounds.play("menu-selection-click.wav")
+                    recorder.add(song_clock.pose_ms(), right_hand)
+
+        if calibration is not None:
+            now_ms = timer() * 1000
+            if calibration.update(now_ms):
+                sounds.play("menu-selection-click.wav")
+            if key == pygame.K_SPACE:
+                calibration.tap(key_ms)
+            in_box = len(right_hand) > 0 and calibration_box[0] <= right_hand[8][0] <= calibration_box[2] \
+                and calibration_box[1] <= right_hand[8][1] <= calibration_box[3]
+            calibration.touch(in_box, now_ms)
+            if calibration.done():
+                calibrated = calibration.result()
+                print("calibrated:", calibrated)
+                song_clock.audio_offset_ms = calibrated["audio_offset_ms"]
+                song_clock.camera_latency_ms = calibrated["camera_latency_ms"]
+                engine.latency_ms = song_clock.camera_latency_ms
+                devices[device] = {"audio_offset_ms" : song_clock.audio_offset_ms, "camera_latency_ms" : song_clock.camera_latency_ms}
+                if save:
+                    writer.write_json(DEVICES_PATH, devices)
+                calibration = None
+                inputs.add(CALIBRATED)
+            else:
+                debug_image = overlay.draw(debug_image, draw_calibration, calibration.phase, calibration_box)
+
+        if music.get_busy():
+            # re-read, the song may have only just been started this frame
+            song_clock.update()
+            song_ms = song_clock.song_ms()
+            pose_ms = song_clock.pose_ms()
+            song_pos = song_ms // 1000
         else:
             song_pos = 0
-            if not show_start_screen and (is_recording or show_target):
-                if hit_interval == 2:
-                    print("unsetting fluid hit interval")
-                    hit_interval = temp_hit_interval
-                show_end_screen = True
-                is_recording = False
-                show_target = False
-
-        if show_start_screen:
-            debug_image = draw_button(debug_image, start_coords, "Start")
-            debug_image = draw_message(debug_image, "Songs and levels can be added to in their respective folders in game files.", (10, 80))
-            debug_image = draw_message(debug_image, "Press [r] to restart (keeps loaded level)", (10, 120))
-            debug_image = draw_message(debug_image, "Press [s] to load different level", (10, 150))
-            debug_image = draw_message(debug_image, "Press [z] to change settings", (10, 180))
-            debug_image = draw_message(debug_image, "Recording: ", (10, 240))
-            debug_image = draw_message(debug_image, "A level consists of a series of snapshots of movements.", (10, 270))
-            debug_image = draw_message(debug_image, "Press [q] to record right hand (only records when [a] is pressed)", (10, 300))
-            debug_image = draw_message(debug_image, "Press [w] to record both hands (constantly records)", (10, 330))
-            debug_image = draw_message(debug_image, "After recording both hands, press [e] to replay movements", (10, 360))
-            debug_image = draw_message(debug_image, "Press [a] to choose snapshot to add to level (during right hand or replay)", (10, 390))
-            debug_image = draw_message(debug_image, "Touch circle below to begin.", (10, 420))
-
-        if show_target:
-            if aura_time > 0:
-                aura_time -= 1
-                debug_image = draw_aura(debug_image, (255, 255, 255), (aura_time / 10))
+            if engine.mode == PLAYING_MODE:
+                inputs.add(END)
+
+        # a setlist goes straight on to its next level once that has been prefetched
+        if setlist is not None and engine.mode == ENDED_MODE and setlist.ready():
+            song_name, recorded_times, recorded_coords, song_file = setlist.advance()
+            level_name = setlist.level_name()
+            if song_file is not None:
+                music.load(song_file, song_name)
+            else:
+                music.load(songs_path + song_name)
+            music.play()
+            song_clock.start(0)
+            song_clock.update()
+            song_ms = song_clock.song_ms()
+            pose_ms = song_clock.pose_ms()
+            high_score = scores.get(level_name)
+            engine.reset(recorded_times, recorded_coords)
+            engine.seek(0)
+            inputs.add(START)
+
+        previous_mode = engine.mode
+        previous_key_frames = engine.key_frames
+        judgement, misses = engine.update(song_ms, hands_seen, inputs)
+        # everything below only draws, from this snapshot, or acts on the mode it changed to
+        state = engine.snapshot()
+        entered = state.mode != previous_mode
+        if judgement is not None:
+            sounds.play("menu-selection-click.wav")
+        if entered and previous_mode == SETTINGS_MODE:
+            preferences_save = load_preferences
+            preferences_save["hit_window"] = engine.hit_window
+            preferences_save["hit_tolerance"] = hit_matcher.tolerance
+            preferences_save["no_camera"] = engine.no_camera
+            writer.write_json(preferences_path, preferences_save)
+        if entered and state.mode == NAMING_MODE:
+            print("entering recording mode")
+            if state.recording == 2:
+                print("two-handed mode")
+            recorded_coords = deque()
+            recorded_times = deque()
+        if state.key_frames and not previous_key_frames:
+            print("entering key frame mode")
+            key_frame_times = []
+            key_frame_coords = []
+        if entered and state.mode == LEVEL_SELECT_MODE:
+            library.scan()
+            level_names = [name for name, _ in library.entries()]
+            level_selection = level_names.index(level_name) if level_name in level_names else 0
+        if entered and state.mode == CALIBRATION_MODE:
+            calibration = LatencyCalibration(song_clock.audio_offset_ms, song_clock.camera_latency_ms)
+            calibration.start(timer() * 1000)
+        if START in inputs and state.mode == PLAYING_MODE and telemetry_enabled and not (state.recording or state.key_frames):
+            os.makedirs(telemetry_path, exist_ok=True)
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            telemetry = TelemetryRecorder(telemetry_path + telemetry_name(level_name, stamp), {
+                "level" : level_name,
+                "hit_tolerance" : hit_matcher.tolerance,
+                "hit_window" : engine.hit_window,
+                "lookahead_ms" : lookahead,
+                "start_ms" : engine.start_ms,
+                "device" : device,
+                "audio_offset_ms" : song_clock.audio_offset_ms,
+                "camera_latency_ms" : song_clock.camera_latency_ms
+            })
+        show_target = state.mode == PLAYING_MODE
+        profiler.mark("update")
+
+        if state.mode == SETTINGS_MODE:
+            debug_image = overlay.draw(debug_image, draw_settings, engine.hit_window, hit_matcher.tolerance, engine.no_camera, state.prompt)
+        elif state.mode == NAMING_MODE:
+            if state.prompt == 0:
+                debug_image = overlay.draw(debug_image, draw_message, "Enter song file name: ")
+            else:
+                debug_image = overlay.draw(debug_image, draw_message, "Enter level name (without extension): ")
+        elif state.mode == LEVEL_SELECT_MODE:
+            levels = library.entries()
+            first_row = min(max(level_selection - level_menu_rows // 2, 0), max(len(levels) - level_menu_rows, 0))
+            rows = tuple(format_level(name, entry) for name, entry in levels[first_row:first_row + level_menu_rows])
+            status = "Scanning levels..." if library.scanning else "%d levels" % len(levels)
+            debug_image = overlay.draw(debug_image, draw_level_menu, rows, level_selection - first_row, status)
+            preview = levels[level_selection][1]["preview"] if len(levels) > 0 else None
+            if preview is not None:
+                # one-handed previews are a single hand, two-handed ones a [left, right] pair
+                preview_hands = preview if len(preview) == 2 else [preview]
+                preview_hands = tuple(tuple(tuple(point) for point in hand) for hand in preview_hands)
+                debug_image = overlay.draw(debug_image, draw_preview, preview_hands)
+        elif state.mode == LOADING_MODE:
+            debug_image = overlay.draw(debug_image, draw_message, "Loading " + loading_level + "...")
+        elif state.mode == START_MODE:
+            debug_image = overlay.draw(debug_image, draw_start, start_coords, format_time(state.start_ms // 1000))
+
+        if state.key_frames:
+            debug_image = overlay.draw(debug_image, draw_mode, "KEYFRAME MODE")
+        elif setlist is not None and not state.recording:
+            debug_image = overlay.draw(debug_image, draw_mode, "SETLIST %d/%d" % (setlist.position + 1, len(setlist)))
+        if state.recording:
+            mode_desc = "RECORD MODE"
+            if state.recording == 2:
+                mode_desc += ":TWO HANDS"
+            else:
+                mode_desc += ":ONE HAND"
+            if recorder is not None:
+                mode_desc += ":RECORDING"
+            debug_image = overlay.draw(debug_image, draw_mode, mode_desc)
+
+        if show_target and state.aura > 0:
+            debug_image = draw_aura(debug_image, (255, 255, 255), state.aura)
 
             
-        if show_end_screen:
-            debug_image = draw_message(debug_image, "Press [r] to restart (keeps loaded level)")
-            if (recording_mode or key_frame_mode):
-                if not written_end:
-                    is_recording = False
-                    written_end = True
-
-                    if key_frame_mode:
+        if state.mode == ENDED_MODE:
+            if setlist is None or setlist.finished():
+                debug_image = overlay.draw(debug_image, draw_message, "Press [r] to restart (keeps loaded level)")
+            if (state.recording or state.key_frames):
+                if entered:
+                    if state.key_frames:
                         recorded_coords = deque(key_frame_coords)
                         recorded_times = deque(key_frame_times)
+                    elif recorder is not None:
+                        recorded_times, recorded_coords = recorder.finish()
 
-                    recording_save = {
-                    "songname" : song_name,
-                    "coords" : list(recorded_coords),
-                    "times" : list(recorded_times)
-                    }
-                    
-                    try:
-                        with open(levels_path + level_name, "w") as json_file:
-                            json.dump(recording_save, json_file)
-                    except Exception:
-                        print("unable to write to level")
+                    if recorder is not None:
+                        writer.submit(levels_path + level_name, recorder.save, recorded_times, recorded_coords)
+                    else:
+                        writer.submit(levels_path + level_name, save_level, levels_path + level_name, song_name,
+                                      list(recorded_times), list(recorded_coords))
+                    recorder = None
 
-                    print("done writing")
+                    print("writing " + level_name)
 
 
             else:
                 # show_target = False
-                if play_end_sound:
-                    pygame.mixer.Sound(sfx_path + "applause.wav").play()
-                    if points > high_score:
-                        high_score = points
-                        preferences_save = load_preferences
-                        preferences_save[(level_name + "_high_score")] = high_score
-                        try:
-                            with open(preferences_path, "w") as json_file:
-                                json.dump(preferences_save, json_file)
-                        except Exception:
-                            print("unable to write high score to preferences")
-                    play_end_sound = False
-                draw_end(debug_image, points, high_score, [350, 370])
-                
-        if show_target and len(target_coords) > 0:
-            for i, coords in enumerate(target_coords):
-                if len(coords) == 2:
-                    debug_image = draw_landmarks(debug_image, coords[0], (target_times[i] / hit_interval), (255, 255 - ((i * 25) % 250), 0))
-                    debug_image = draw_landmarks(debug_image, coords[1], (target_times[i] / hit_interval), (255, 255 - ((i * 25) % 250), 0))
+                if entered:
+                    if setlist is not None:
+                        setlist.record(state.points, state.counts)
+                        if setlist.finished():
+                            print("setlist:", setlist.summary())
+                    if setlist is None or setlist.finished():
+                        sounds.play("applause.wav")
+                    if state.points > high_score:
+                        high_score = state.points
+                        if save:
+                            scores.record(level_name, high_score)
+                            library.record_score(level_name, high_score)
+                if setlist is None:
+                    debug_image = overlay.draw(debug_image, draw_end, state.points, high_score, (350, 370))
+                elif setlist.finished():
+                    summary = setlist.summary()
+                    rows = tuple(format_setlist_level(result) for result in summary["levels"])
+                    debug_image = overlay.draw(debug_image, draw_setlist, rows, summary["points"])
                 else:
-                    debug_image = draw_landmarks(debug_image, coords, (target_times[i] / hit_interval), (255, 0, 0))
-                target_times[i] -= 1
-            if target_times[0] < 0:
-                combo = 0
-                target_coords.popleft()
-                target_times.popleft()
+                    debug_image = overlay.draw(debug_image, draw_message, "Next: " + setlist.levels[setlist.position + 1] + "...")
+                
+        debug_image = target_renderer.draw(debug_image, state.targets, state.target_times, state.song_ms)
+
+        if telemetry is not None:
+            # the frame the song ended on is logged too, its hit test still counted
+            telemetry.add(timer() * 1000, song_ms, pose_ms, hit_ms, left_hand, right_hand, hand_scores, engine.track.scheduler.cursor,
+                          len(engine.track.target_coords), judgement, misses, not show_target)
+            if not show_target:
+                print("telemetry:", telemetry.stats())
+                telemetry.close()
+                telemetry = None
             
-        song_pos = datetime.time(minute=(song_pos//60), second=(song_pos%60)).strftime("%M:%S")
-        debug_image = draw_info(debug_image, points, combo, song_pos, song_length, show_target)
-        debug_image = draw_input(debug_image, user_text)
+        song_pos = format_time(song_pos)
+        song_length = song_meta.length(songs_path + song_name)
+        song_length = "--:--" if song_length is None else format_time(int(song_length))
+        debug_image = draw_info(debug_image, overlay, state.points, state.combo, song_pos, song_length, show_target)
+        if state.message is not None:
+            debug_image = overlay.draw(debug_image, draw_message, state.message, (10, 120))
+        if len(user_text) > 0:
+            debug_image = overlay.draw_text(debug_image, draw_input, user_text, (10, 480))
+        if show_profile:
+            debug_image = draw_profile(debug_image, profiler.overlay_lines())
+        profiler.mark("draw")
         # Display #############################################################
         
-        imp = pygame.image.frombuffer(debug_image.tobytes(), debug_image.shape[1::-1], "BGR")
-        scrn = pygame.display.set_mode((cap_width, cap_height))
-        scrn.blit(imp, (0,0))
+        scrn.blit(buffers.surface(debug_image), (0,0))
         pygame.display.flip()
+        profiler.mark("display")
+        profiler.end_frame()
+        target_renderer.adjust(profiler.busy_ms())
+
+        if quit_at_end and state.mode == ENDED_MODE and (setlist is None or setlist.finished()):
+            running = False
     
+    if pipeline is not None:
+        pipeline.stop()
+        print("pipeline stats:", pipeline.stats())
+    elif isinstance(hands, AdaptiveHands):
+        print("inference stats:", hands.stats())
+    if profile_trace:
+        try:
+            profiler.export(profile_trace)
+        except Exception:
+            print("unable to write profile trace")
+    if recorder is not None:
+        # quit mid-take, the journal is left for recorder.py to recover
+        recorder.close()
+    if telemetry is not None:
+        telemetry.close()
+    library.close()
+    if setlist is not None:
+        setlist.close()
+    # anything still queued is written before the game exits
+    scores.close()
+    writer.close()
     cap.release()
     pygame.quit()
 
+    state = engine.snapshot()
+    return {
+        "level" : level_name,
+        "points" : state.points,
+        "judgements" : state.counts,
+        "frames" : profiler.frame_count,
+        "startup" : startup.stats(),
+        "render" : target_renderer.stats(),
+        "setlist" : None if setlist is None else setlist.summary()
+    }
+
+def load_hands(camera, cap_width, cap_height, inference_workers, pipelined, detection_confidence, tracking_confidence, adaptive_inference):
+    # (pipeline, hands), runs as a startup task, camera is the camera task's Future
+    if inference_workers > 0:
+        return InferencePool([camera.result()[0]], cap_width, cap_height, workers=inference_workers, min_detection_confidence=detection_confidence,
+                             min_tracking_confidence=tracking_confidence).start(), None
+    if pipelined:
+        return HandPipeline(camera.result()[0], cap_width, cap_height, min_detection_confidence=detection_confidence,
+                            min_tracking_confidence=tracking_confidence, adaptive=adaptive_inference).start(), None
+    import mediapipe as mp
+    mp_hands = mp.solutions.hands
+    hands = mp_hands.Hands(
+        max_num_hands=2,
+        min_detection_confidence=detection_confidence,
+        min_tracking_confidence=tracking_confidence,
+    )
+    if adaptive_inference is not None:
+        hands = AdaptiveHands(hands, **adaptive_inference)
+    return None, hands
+
+def format_time(seconds):
+    return datetime.time(minute=(seconds//60), second=(seconds%60)).strftime("%M:%S")
+
 def calc_landmark_list(image, landmarks):
     image_width, image_height = image.shape[1], image.shape[0]
 
@@ -562,7 +743,8 @@ def calc_landmark_list(image, landmarks):
 
 
 def draw_landmarks(image, landmark_point, transparency, color):
-    initial_image = image.copy()
+    # opaque hands can be drawn straight onto the image
+    initial_image = image.copy() if transparency < 1 else image
     if len(landmark_point) > 0:
         finger = 1
         cv.line(image, tuple(landmark_point[0]), tuple(landmark_point[finger]), color, 2)
@@ -572,20 +754,18 @@ def draw_landmarks(image, landmark_point, transparency, color):
             cv.line(image, tuple(landmark_point[finger]), tuple(landmark_point[(finger+4)%21]), color, 2)
             finger += 4
 
-    cv.addWeighted(initial_image, 1 - transparency, image, transparency, 0, initial_image)
+    if transparency < 1:
+        cv.addWeighted(initial_image, 1 - transparency, image, transparency, 0, initial_image)
     image = initial_image
     return image
 
-def draw_info(image, points, combo, song_pos, song_length, show_points):
-    cv.putText(image, song_pos + "/" + song_length, (10, 30), cv.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv.LINE_AA)
-    cv.putText(image, song_pos + "/" + song_length, (10, 30), cv.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 1, cv.LINE_AA)
+def draw_info(image, overlay, points, combo, song_pos, song_length, show_points):
+    # the clock changes once a second and is cached, points and combo change with almost every hit in fluid levels
+    image = overlay.draw_text(image, draw_input, song_pos + "/" + song_length, (10, 30))
 
     if show_points:
-        cv.putText(image, "Points:" + (str) (points), (10, 60), cv.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv.LINE_AA)
-        cv.putText(image, "Points:" + (str) (points), (10, 60), cv.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 1, cv.LINE_AA)
-
-        cv.putText(image, "Combo:" + (str) (combo), (10, 90), cv.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2, cv.LINE_AA)
-        cv.putText(image, "Combo:" + (str) (combo), (10, 90), cv.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 1, cv.LINE_AA)
+        image = draw_input(image, "Points:" + (str) (points), (10, 60))
+        image = draw_input(image, "Combo:" + (str) (combo), (10, 90))
     
     return image
 
@@ -595,6 +775,79 @@ def  draw_input(image, text, coords=(10, 480)):
 
     return image
 
+def draw_start(image, start_coords, practice_start):
+    image = draw_button(image, start_coords, "Start")
+    image = draw_message(image, "Songs and levels can be added to in their respective folders in game files.", (10, 80))
+    image = draw_message(image, "Press [r] to restart (keeps loaded level)", (10, 120))
+    image = draw_message(image, "Press [s] to choose a different level, [c] to calibrate latency", (10, 150))
+    image = draw_message(image, "Press [z] to change settings, [p] for performance overlay", (10, 180))
+    image = draw_message(image, "Press [left]/[right] to change practice start - " + practice_start, (10, 210))
+    image = draw_message(image, "Recording: ", (10, 240))
+    image = draw_message(image, "A level consists of a series of snapshots of movements.", (10, 270))
+    image = draw_message(image, "Press [q] to record right hand (only records when [a] is pressed)", (10, 300))
+    image = draw_message(image, "Press [w] to record both hands (constantly records)", (10, 330))
+    image = draw_message(image, "After recording both hands, press [e] to replay movements", (10, 360))
+    image = draw_message(image, "Press [a] to choose snapshot to add to level (during right hand or replay)", (10, 390))
+    image = draw_message(image, "Touch circle below to begin.", (10, 420))
+
+    return image
+
+def draw_settings(image, hit_window, hit_tolerance, no_camera, prompt):
+    image = draw_message(image, "CURRENT SETTINGS")
+    image = draw_message(image, "Milliseconds target appears - " + str(hit_window), (10, 150))
+    image = draw_message(image, "Distance to hit target - " + str(hit_tolerance), (10, 180))
+    image = draw_message(image, "Show Camera - " + ("OFF" if no_camera else "ON"), (10, 210))
+    if prompt == 0:
+        image = draw_message(image, "Enter # milliseconds target appears (or nothing to keep current):", (10, 250))
+    elif prompt == 1:
+        image = draw_message(image, "Enter distance to hit target (or nothing to keep current):", (10, 250))
+    elif prompt == 2:
+        image = draw_message(image, "Toggle camera mode? [y/(N)]:", (10, 250))
+
+    return image
+
+def format_level(name, entry):
+    hands = "two hands" if entry["hands"] == 2 else "one hand"
+    fluid = ", fluid" if entry["fluid"] else ""
+    return "%s - %d targets, %s, %s%s - best %d" % (name[:-len(".hdlevel")], entry["targets"], format_time(entry["duration_ms"] // 1000),
+                                                      hands, fluid, entry.get("high_score", 0))
+
+def draw_level_menu(image, rows, selected, status):
+    image = draw_message(image, "SELECT LEVEL", (10, 80))
+    image = draw_message(image, "[up]/[down] to choose, [enter] to load, [s] to go back", (10, 110))
+    for i, row in enumerate(rows):
+        image = draw_message(image, ("> " if i == selected else "   ") + row, (10, 150 + i * 30))
+    image = draw_message(image, status, (10, 510))
+
+    return image
+
+def draw_preview(image, hands, origin=(640, 330), scale=0.3):
+    # first pose of the level, scaled down into the corner
+    cv.rectangle(image, origin, (origin[0] + int(image.shape[1] * scale), origin[1] + int(image.shape[0] * scale)), (255, 255, 255), 1)
+    for hand in hands:
+        points = [[origin[0] + int(x * scale), origin[1] + int(y * scale)] for x, y in hand]
+        image = draw_landmarks(image, points, 1.0, (255, 255, 255))
+
+    return image
+
+def draw_calibration(image, phase, box):
+    if phase == "audio":
+        image = draw_message(image, "CALIBRATION 1/2")
+        image = draw_message(image, "Press [space] on every click", (10, 150))
+    else:
+        image = draw_message(image, "CALIBRATION 2/2")
+        image = draw_message(image, "Touch the box with your right index finger on every click", (10, 150))
+        cv.rectangle(image, box[:2], box[2:], (255, 255, 255), 2)
+
+    return image
+
+def draw_loading(image, progress):
+    image = draw_message(image, "Hand Dance", (10, 80))
+    for i, (name, done) in enumerate(progress):
+        image = draw_message(image, ("[done] " if done else "[....] ") + "loading " + name, (10, 150 + i * 30))
+
+    return image
+
 def draw_mode(image, text):
     return draw_message(image, text, (10, 510))
 
@@ -623,17 +876,38 @@ def draw_button(image, coords, label):
 
     return image
 
+def draw_profile(image, lines, coords=(760, 30)):
+    for i, text in enumerate(lines):
+        position = (coords[0], coords[1] + i * 22)
+        cv.putText(image, text, position, cv.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2, cv.LINE_AA)
+        cv.putText(image, text, position, cv.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv.LINE_AA)
+
+    return image
+
 def draw_aura(image, color, transparency):
     thickness = 5
     if (transparency >= 0):
-        initial_image = image.copy()
-        cv.rectangle(image, (0,0), (thickness, image.shape[0]), color, -1)
-        cv.rectangle(image, (0,0), (image.shape[1], thickness), color, -1)
-        cv.rectangle(image, (0, image.shape[0] - thickness), (image.shape[1], image.shape[0]), color, -1)
-        cv.rectangle(image, (image.shape[1] - thickness,0), (image.shape[1], image.shape[0]), color, -1)
-        cv.addWeighted(initial_image, 1 - transparency, image, transparency, 0, initial_image)
-        image = initial_image
+        # only the border strips are blended, not the whole frame
+        edge = thickness + 1
+        strips = (image[:edge], image[-edge:], image[edge:-edge, :edge], image[edge:-edge, -edge:])
+        for strip in strips:
+            strip[:] = strip * (1 - transparency) + np.asarray(color) * transparency
+
+    return image
 
+def format_setlist_level(result):
+    counts = result["judgements"]
+    level = result["level"][:-len(".hdlevel")]
+    if "played" in result:
+        level += " (played " + result["played"][:-len(".hdlevel")] + ")"
+    return "%s - %d (%d perfect, %d good, %d miss)" % (level, result["points"], counts.get("perfect", 0), counts.get("good", 0),
+                                                       counts.get("miss", 0))
+
+def draw_setlist(image, rows, points):
+    image = draw_message(image, "SETLIST COMPLETE", (10, 150))
+    for i, row in enumerate(rows[:10]):
+        image = draw_message(image, row, (10, 190 + i * 30))
+    image = draw_message(image, "Total: " + str(points), (10, 200 + min(len(rows), 10) * 30))
     return image
 
 def draw_end(image, points, high_score, position):
@@ -0,0 +1,64 @@
+"""
+Sound effects for Hand Dance.
+
+SoundBank decodes every sound in sfx/ once, keyed by file name, and plays each on its own reserved mixer
+channels, rotating through a small pool so rapid hits don't cut each other off.
+"""
+
+import os
+
+import pygame
+
+SOUND_EXTENSIONS = (".wav", ".ogg")
+# how many overlapping copies of a sound can play at once, one unless listed
+SOUND_CHANNELS = {
+    "menu-selection-click.wav" : 4
+}
+
+
+class SoundBank:
+    def __init__(self, sfx_path, channel_counts=SOUND_CHANNELS):
+        self.sounds = {}
+        for file_name in sorted(os.listdir(sfx_path)):
+            if file_name.lower().endswith(SOUND_EXTENSIONS):
+                try:
+                    self.sounds[file_name] = pygame.mixer.Sound(os.path.join(sfx_path, file_name))
+                except pygame.error:
+                    print("unable to load sound " + file_name)
+
+        reserved = sum(channel_counts.get(name, 1) for name in self.sounds)
+        if pygame.mixer.get_num_channels() < reserved + 8:
+            pygame.mixer.set_num_channels(reserved + 8)
+        pygame.mixer.set_reserved(reserved)
+
+        self.channels = {}
+        first_channel = 0
+        for name in self.sounds:
+            count = channel_counts.get(name, 1)
+            self.channels[name] = [pygame.mixer.Channel(first_channel + i) for i in range(count)]
+            first_channel += count
+        self.next_channel = dict.fromkeys(self.sounds, 0)
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            return None
+        channels = self.channels[name]
+        # an idle channel if there is one, otherwise the one that started longest ago
+        for channel in channels:
+            if not channel.get_busy():
+                break
+        else:
+            channel = channels[self.next_channel[name]]
+            self.next_channel[name] = (self.next_channel[name] + 1) % len(channels)
+        channel.play(sound)
+        return channel
+
+    def stop(self, name):
+        for channel in self.channels.get(name, []):
+            channel.stop()
+
+    def stop_all(self):
+        for channels in self.channels.values():
+            for channel in channels:
+                channel.stop()
@@ -0,0 +1,87 @@
+"""
+Headless benchmark for Hand Dance.
+
+Plays every level without a camera, MediaPipe or audio: frames are synthetic, the detected hands are the
+level's own recorded poses and the song runs on a simulated clock that advances a fixed step per frame, so
+each run is deterministic. Reports per-stage p50/p95/p99 frame times and the final score for each level.
+
+    python bench.py                          every level in levels/ at 30 fps
+    python bench.py levels/alphabet.hdlevel --fps 15
+    python bench.py --json bench.json
+    python bench.py --fps 15 30 60           also checks every level scores the same at each rate
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from sources import use_headless_display
+
+use_headless_display()
+
+import app
+from levelfile import load_level
+from profiler import FrameProfiler
+from sources import LandmarkReplay, SimulatedClock, SimulatedMusic, SyntheticFrameSource
+
+CAP_WIDTH = 960
+CAP_HEIGHT = 540
+# how long the simulated song keeps playing after the last target
+SONG_TAIL_MS = 2000
+
+
+def run_level(level_path, fps=30):
+    _, times, coords = load_level(level_path)
+    clock = SimulatedClock(1000 / fps)
+    music = SimulatedMusic(clock, int(max(times, default=0)) + SONG_TAIL_MS)
+    cap = SyntheticFrameSource(CAP_WIDTH, CAP_HEIGHT, clock)
+    hands = LandmarkReplay(times, coords, music, CAP_WIDTH, CAP_HEIGHT, (CAP_WIDTH//2, CAP_HEIGHT-60))
+    profiler = FrameProfiler(capacity=1 << 16)
+
+    result = app.main(os.path.basename(level_path), cap=cap, hands=hands, music=music, profiler=profiler,
+                      quit_at_end=True, save=False, timer=clock.seconds)
+    result["fps"] = fps
+    result["stages"] = profiler.percentiles()
+    return result
+
+
+def print_result(result):
+    print("%s @ %d fps: %d points %s, %d frames" % (result["level"], result["fps"], result["points"], result["judgements"], result["frames"]))
+    for stage, summary in result["stages"].items():
+        print("    %-10s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms" % (stage, summary["p50"], summary["p95"], summary["p99"]))
+
+
+def check_fps(results):
+    # levels whose points differ between frame rates, {level : {fps : points}}
+    points = {}
+    for result in results:
+        points.setdefault(result["level"], {})[result["fps"]] = result["points"]
+    return {level : by_fps for level, by_fps in points.items() if len(set(by_fps.values())) > 1}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless Hand Dance benchmark")
+    parser.add_argument("levels", nargs="*", help="level files, defaults to every level in levels/")
+    parser.add_argument("--fps", nargs="+", type=int, default=[30], help="simulated camera frame rates")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for level_path in args.levels or sorted(glob.glob("levels/*.hdlevel")):
+        for fps in args.fps:
+            result = run_level(level_path, fps)
+            print_result(result)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if len(args.fps) > 1:
+        differences = check_fps(results)
+        for level, by_fps in differences.items():
+            print("%s scores differ across frame rates: %s" % (level, ", ".join("%d fps %d" % item for item in sorted(by_fps.items()))))
+        if len(differences) > 0:
+            sys.exit(1)
@@ -0,0 +1,119 @@
+"""
+Camera capture for Hand Dance.
+
+open_camera tries the platform's backends (PLATFORM_BACKENDS) in order, asks each for PIXEL_FORMATS at the
+game's resolution and frame rate, and keeps the first mode that delivers frames. The source can also be a
+video file, played in a loop, or "synthetic", a generated test pattern. It returns the capture and the
+negotiated mode:
+    {"backend" : "V4L2", "format" : "MJPG", "width" : 960, "height" : 540, "fps" : 30.0, "native" : True}
+"""
+
+import sys
+
+import cv2 as cv
+
+from sources import SimulatedClock, SyntheticFrameSource, VideoFileSource
+
+SYNTHETIC_SOURCE = "synthetic"
+PIXEL_FORMATS = ("MJPG", "YUYV")
+CAPTURE_FPS = 30
+
+if sys.platform.startswith("win"):
+    PLATFORM_BACKENDS = ("DSHOW", "MSMF")
+elif sys.platform == "darwin":
+    PLATFORM_BACKENDS = ("AVFOUNDATION",)
+else:
+    PLATFORM_BACKENDS = ("V4L2", "GSTREAMER")
+
+
+def fourcc_name(value):
+    value = int(value)
+    name = "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+    return name if name.isprintable() and value != 0 else "----"
+
+
+def camera_backends(names=PLATFORM_BACKENDS):
+    # [(name, api)] of the backends in names this OpenCV build has, in order, then whatever OpenCV picks
+    try:
+        available = set(cv.videoio_registry.getCameraBackends())
+    except AttributeError:
+        available = None
+    backends = []
+    for name in names:
+        api = getattr(cv, "CAP_" + name, None)
+        if api is not None and (available is None or api in available):
+            backends.append((name, api))
+    backends.append(("ANY", cv.CAP_ANY))
+    return backends
+
+
+def capture_mode(backend, pixel_format, frame, fps, width, height):
+    frame_height, frame_width = frame.shape[:2]
+    return {
+        "backend" : backend,
+        "format" : pixel_format,
+        "width" : frame_width,
+        "height" : frame_height,
+        "fps" : fps,
+        "native" : (frame_width, frame_height) == (width, height)
+    }
+
+
+def request_mode(cap, pixel_format, width, height, fps):
+    # V4L2 only applies the pixel format when it is set before the size
+    cap.set(cv.CAP_PROP_FOURCC, cv.VideoWriter_fourcc(*pixel_format))
+    cap.set(cv.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv.CAP_PROP_FPS, fps)
+    return cap.read()
+
+
+def negotiate(cap, backend, width, height, fps, pixel_formats):
+    # mode of the first pixel format that delivers frames at the game's size, otherwise of the first that delivers
+    # frames at all, a format the camera can't do is skipped
+    fallback = None
+    for pixel_format in pixel_formats:
+        ret, frame = request_mode(cap, pixel_format, width, height, fps)
+        if not ret or frame is None:
+            continue
+        mode = capture_mode(backend, fourcc_name(cap.get(cv.CAP_PROP_FOURCC)), frame, cap.get(cv.CAP_PROP_FPS), width, height)
+        if mode["native"]:
+            return mode
+        if fallback is None:
+            fallback = pixel_format
+    if fallback is None:
+        return None
+    # the camera is still set to the last format tried, so the fallback is asked for again and read back
+    ret, frame = request_mode(cap, fallback, width, height, fps)
+    if not ret or frame is None:
+        return None
+    return capture_mode(backend, fourcc_name(cap.get(cv.CAP_PROP_FOURCC)), frame, cap.get(cv.CAP_PROP_FPS), width, height)
+
+
+def open_camera(source=0, width=960, height=540, fps=CAPTURE_FPS, backends=PLATFORM_BACKENDS, pixel_formats=PIXEL_FORMATS):
+    # (capture, mode), source is a camera index, a video file or SYNTHETIC_SOURCE
+    if source == SYNTHETIC_SOURCE:
+        cap = SyntheticFrameSource(width, height, SimulatedClock(1000 / fps))
+        return cap, {"backend" : "synthetic", "format" : "BGR", "width" : width, "height" : height, "fps" : fps, "native" : True}
+    if isinstance(source, str):
+        cap = VideoFileSource(source, SimulatedClock(1000 / fps), loop=True)
+        ret, frame = cap.read()
+        if not ret:
+            print("unable to read video " + source)
+            return cap, None
+        cap.set(cv.CAP_PROP_POS_FRAMES, 0)
+        return cap, capture_mode("file", fourcc_name(cap.capture.get(cv.CAP_PROP_FOURCC)), frame,
+                                 cap.capture.get(cv.CAP_PROP_FPS), width, height)
+
+    for name, api in camera_backends(backends):
+        cap = cv.VideoCapture(source, api)
+        if not cap.isOpened():
+            cap.release()
+            continue
+        mode = negotiate(cap, name, width, height, fps, pixel_formats)
+        if mode is not None:
+            return cap, mode
+        cap.release()
+    print("unable to open camera " + str(source))
+    # reads fail, so the game ends the way it always did without a camera
+    return cv.VideoCapture(), None
@@ -0,0 +1,222 @@
+"""
+Gameplay engine for Hand Dance.
+
+GameEngine holds which screen the game is on, what is being recorded and the targets and hit flash of a
+play-through, and only changes them in update(now_ms, hands, inputs), called once per frame:
+
+    now_ms      song position as heard
+    hands       (left, right, pose_ms) seen since the last update, pose_ms being when they were in that pose,
+                or None when there are none to judge
+    inputs      events since the last update, the constants below and (SUBMIT, text) for typed text
+
+While playing, targets are released and expired in fixed scoring.TICK_MS steps of song time up to now_ms,
+however far apart the frames are, then the hands are hit tested at pose_ms. Rendering reads snapshot(), a
+GameState. The engine has no pygame, OpenCV or audio dependencies.
+
+Modes and the flags that go with them:
+
+    START_MODE          start screen, recording is the number of hands a take records (0 plays the level
+                        back) and key_frames whether a playback picks the level's key frames
+    PLAYING_MODE        the song is playing
+    ENDED_MODE          end screen
+    SETTINGS_MODE       typing the hit window, hit tolerance and camera setting, prompt is which one
+    NAMING_MODE         typing the song file and level name of a take
+    LEVEL_SELECT_MODE   level menu
+    LOADING_MODE        waiting for a level to load, reset() with it returns to the start screen
+    CALIBRATION_MODE    latency calibration
+"""
+
+from scoring import TargetTrack
+
+START_MODE = "start"
+PLAYING_MODE = "playing"
+ENDED_MODE = "ended"
+SETTINGS_MODE = "settings"
+NAMING_MODE = "naming"
+LEVEL_SELECT_MODE = "level select"
+LOADING_MODE = "loading"
+CALIBRATION_MODE = "calibration"
+
+# inputs
+START = "start"
+END = "end"
+FLASH = "flash"
+SETTINGS = "settings"
+RECORD = "record"
+RECORD_TWO_HANDS = "record two hands"
+KEY_FRAMES = "key frames"
+LEVEL_SELECT = "level select"
+LOAD = "load"
+CALIBRATE = "calibrate"
+CALIBRATED = "calibrated"
+SEEK_BACK = "seek back"
+SEEK_FORWARD = "seek forward"
+SUBMIT = "submit"
+# stops naming a take, for a song that couldn't be loaded
+SKIP = "skip"
+
+# how long the screen flashes after a hit
+AURA_MS = 330
+# how far the practice start point moves
+SEEK_MS = 5000
+# the prompts of each typing mode
+PROMPTS = {SETTINGS_MODE : 3, NAMING_MODE : 2}
+
+
+class GameState:
+    # what one rendered frame needs, copied out of the engine
+    def __init__(self, mode, song_ms, pose_ms, start_ms, points, combo, counts, targets, target_times, message, aura,
+                 recording, key_frames, prompt, typing):
+        self.mode = mode
+        self.song_ms = song_ms
+        self.pose_ms = pose_ms
+        self.start_ms = start_ms
+        self.points = points
+        self.combo = combo
+        self.counts = counts
+        # ((coords, fade), ...), oldest first
+        self.targets = targets
+        # when each of them is due
+        self.target_times = target_times
+        self.message = message
+        # strength of the hit flash, 0 to 1
+        self.aura = aura
+        self.recording = recording
+        self.key_frames = key_frames
+        self.prompt = prompt
+        self.typing = typing
+
+
+class GameEngine:
+    def __init__(self, times, coords, hit_window, matcher, lookahead_ms=0, latency_ms=0, no_camera=False):
+        self.hit_window = hit_window
+        self.matcher = matcher
+        self.lookahead_ms = lookahead_ms
+        # camera to landmark latency, targets expire against when the hands were seen
+        self.latency_ms = latency_ms
+        self.no_camera = no_camera
+        # where in the song playing starts, for practicing a section
+        self.start_ms = 0
+        self.reset(times, coords)
+
+    def reset(self, times, coords):
+        # a level to play from the start screen, anything being recorded or typed is dropped
+        self.times = times
+        self.coords = coords
+        self.mode = START_MODE
+        self.track = TargetTrack(times, coords, self.hit_window, self.matcher, self.lookahead_ms)
+        self.song_ms = 0
+        self.aura_until = None
+        self.recording = 0
+        self.key_frames = False
+        self.prompt = 0
+        self.typing = False
+
+    def seek(self, start_ms):
+        self.start_ms = max(start_ms, 0)
+
+    def pose_time(self, song_ms):
+        return max(song_ms - self.latency_ms, 0)
+
+    def update(self, now_ms, hands=None, inputs=()):
+        # returns (judgement of this update's hit or None, number of targets missed)
+        judgement = None
+        misses = 0
+        self.navigate(inputs)
+        if START in inputs and self.mode == START_MODE:
+            self.mode = PLAYING_MODE
+            # a take starts with nothing to hit
+            times, coords = ([], []) if self.recording else (self.times, self.coords)
+            self.track = TargetTrack(times, coords, self.hit_window, self.matcher, self.lookahead_ms, self.start_ms)
+            self.aura_until = None
+
+        # the song ended, the hit test below still counts but nothing more is released or missed
+        if self.mode == PLAYING_MODE and END not in inputs:
+            misses += len(self.track.advance(now_ms, self.latency_ms))
+        # the hands that pressed start aren't judged
+        if self.mode == PLAYING_MODE and hands is not None and START not in inputs:
+            left_hand, right_hand, pose_ms = hands
+            if len(right_hand) > 0:
+                # compares the hands against every live target at once, see hitmatch.py
+                judgement = self.track.hit(left_hand, right_hand, pose_ms)
+        if judgement is not None or FLASH in inputs:
+            self.aura_until = now_ms + AURA_MS
+        if END in inputs and self.mode == PLAYING_MODE:
+            self.mode = ENDED_MODE
+        self.song_ms = now_ms
+        return judgement, misses
+
+    def navigate(self, inputs):
+        # menu inputs, each only does something on the screen it belongs to
+        playback = self.recording == 0
+        if self.typing:
+            for event in inputs:
+                if isinstance(event, tuple) and event[0] == SUBMIT:
+                    self.answer(event[1])
+        if SKIP in inputs and self.mode == NAMING_MODE:
+            self.mode = START_MODE
+            self.prompt = 0
+            self.typing = False
+        if self.mode == START_MODE:
+            if SETTINGS in inputs and playback:
+                self.mode = SETTINGS_MODE
+                self.typing = True
+            elif RECORD in inputs or RECORD_TWO_HANDS in inputs:
+                self.mode = NAMING_MODE
+                self.recording = 2 if RECORD_TWO_HANDS in inputs else 1
+                self.typing = True
+            elif LEVEL_SELECT in inputs and playback:
+                self.mode = LEVEL_SELECT_MODE
+            elif LOAD in inputs:
+                self.mode = LOADING_MODE
+            elif CALIBRATE in inputs and playback and not self.key_frames:
+                self.mode = CALIBRATION_MODE
+            if KEY_FRAMES in inputs:
+                self.key_frames = True
+            if playback and SEEK_BACK in inputs:
+                self.seek(self.start_ms - SEEK_MS)
+            if playback and SEEK_FORWARD in inputs:
+                self.seek(self.start_ms + SEEK_MS)
+        elif self.mode == LEVEL_SELECT_MODE:
+            if LOAD in inputs:
+                self.mode = LOADING_MODE
+            elif LEVEL_SELECT in inputs:
+                self.mode = START_MODE
+        elif self.mode == CALIBRATION_MODE and CALIBRATED in inputs:
+            self.mode = START_MODE
+
+    def answer(self, text):
+        # typed text for the current prompt, settings that aren't numbers are left as they were
+        if self.mode == SETTINGS_MODE:
+            try:
+                if self.prompt == 0:
+                    # the next start builds its targets with it
+                    self.hit_window = int(text)
+                elif self.prompt == 1:
+                    self.matcher.tolerance = int(text)
+            except ValueError:
+                pass
+            if self.prompt == 2 and text == "y":
+                self.no_camera = not self.no_camera
+        self.prompt += 1
+        if self.prompt == PROMPTS.get(self.mode, 0):
+            self.mode = START_MODE
+            self.prompt = 0
+            self.typing = False
+
+    def snapshot(self):
+        judge = self.track.judge
+        pose_ms = self.pose_time(self.song_ms)
+        targets = ()
+        target_times = ()
+        message = None
+        if self.mode == PLAYING_MODE:
+            targets = tuple((coords, judge.fade(target_ms, self.song_ms))
+                            for coords, target_ms in zip(self.track.target_coords, self.track.target_times))
+            target_times = tuple(self.track.target_times)
+            message = judge.display(pose_ms)
+        aura = 0.0
+        if self.aura_until is not None and self.song_ms < self.aura_until:
+            aura = (self.aura_until - self.song_ms) / AURA_MS
+        return GameState(self.mode, self.song_ms, pose_ms, self.start_ms, judge.points, judge.combo, dict(judge.counts),
+                         targets, target_times, message, aura, self.recording, self.key_frames, self.prompt, self.typing)
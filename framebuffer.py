@@ -0,0 +1,59 @@
+"""
+Reused frame buffers for Hand Dance.
+
+FrameBuffers allocates the resized, mirrored, drawing, RGB and display buffers once and has OpenCV write
+into them with dst=. The display surface is a view of the drawing buffer.
+"""
+
+import cv2 as cv
+import numpy as np
+import pygame
+
+
+class FrameBuffers:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # camera frame as delivered, allocated by the first read so its size can be whatever the camera gives
+        self.capture = None
+        self.resized = np.zeros((height, width, 3), dtype=np.uint8)
+        # mirrored camera frame at game resolution
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        # what gets drawn on and shown
+        self.display = np.zeros((height, width, 3), dtype=np.uint8)
+        self.rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        self.display_surface = pygame.image.frombuffer(self.display, (width, height), "BGR")
+
+    def read(self, cap):
+        # the camera writes into the previous capture when it can
+        ret, captured = cap.read(self.capture)
+        if ret:
+            self.capture = captured
+        return ret, captured
+
+    def load(self, image):
+        # mirror (and if needed resize) a camera image into the frame buffer
+        if image.shape[:2] == (self.height, self.width):
+            cv.flip(image, 1, dst=self.frame)
+        else:
+            cv.resize(image, (self.width, self.height), dst=self.resized)
+            cv.flip(self.resized, 1, dst=self.frame)
+        return self.frame
+
+    def start_display(self, show_camera=True):
+        # the camera image is only copied into the display buffer when it is going to be seen
+        if show_camera:
+            np.copyto(self.display, self.frame)
+        else:
+            self.display[:] = 0
+        return self.display
+
+    def rgb_frame(self):
+        cv.cvtColor(self.frame, cv.COLOR_BGR2RGB, dst=self.rgb)
+        return self.rgb
+
+    def surface(self, image):
+        # a surface sharing memory with image, no copy when image is the display buffer
+        if image is self.display:
+            return self.display_surface
+        return pygame.image.frombuffer(np.ascontiguousarray(image), (image.shape[1], image.shape[0]), "BGR")
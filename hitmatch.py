@@ -0,0 +1,61 @@
+"""
+Hit detection for Hand Dance.
+
+HandMatcher compares the detected hands against every live target in one NumPy pass. match() returns the
+best matching target, matches() every target that counts as a hit.
+"""
+
+import numpy as np
+
+FINGERTIPS = (4, 8, 12, 16, 20)
+# share of the (weighted) landmarks that must be within tolerance, 4 of 5 fingertips by default
+REQUIRED_MATCH = 0.8
+
+
+class HandMatcher:
+    def __init__(self, tolerance, landmarks=FINGERTIPS, weights=None, required=REQUIRED_MATCH):
+        self.tolerance = tolerance
+        self.landmarks = np.asarray(landmarks, dtype=np.intp)
+        if weights is None:
+            weights = np.ones(len(self.landmarks))
+        self.weights = np.asarray(weights, dtype=np.float32)
+        if len(self.weights) != len(self.landmarks):
+            raise ValueError("need one weight per landmark")
+        self.required = required
+
+    def scores(self, left_hand, right_hand, targets):
+        # (match score, mean distance) per target, one-handed targets are matched by the right hand and
+        # two-handed targets by [left, right]
+        target_array = np.asarray(targets, dtype=np.float32)
+        if target_array.ndim == 3:
+            target_array = target_array[:, np.newaxis]
+            hands = [right_hand]
+        else:
+            hands = [left_hand, right_hand]
+        if any(len(hand) == 0 for hand in hands):
+            return np.zeros(len(target_array)), np.full(len(target_array), np.inf)
+
+        hand_array = np.asarray(hands, dtype=np.float32)[:, self.landmarks]
+        distance = np.linalg.norm(target_array[:, :, self.landmarks] - hand_array, axis=-1)
+        total_weight = self.weights.sum() * len(hands)
+        score = ((distance < self.tolerance) * self.weights).sum(axis=(1, 2)) / total_weight
+        mean_distance = (distance * self.weights).sum(axis=(1, 2)) / total_weight
+        return score, mean_distance
+
+    def matches(self, left_hand, right_hand, targets):
+        # indices of every target that counts as a hit, in order
+        if len(targets) == 0:
+            return []
+        score, _ = self.scores(left_hand, right_hand, targets)
+        return np.flatnonzero(score >= self.required - 1e-6).tolist()
+
+    def match(self, left_hand, right_hand, targets):
+        # index of the best matching target that counts as a hit, or None
+        if len(targets) == 0:
+            return None
+        score, mean_distance = self.scores(left_hand, right_hand, targets)
+        hits = np.flatnonzero(score >= self.required - 1e-6)
+        if len(hits) == 0:
+            return None
+        best = np.lexsort((mean_distance[hits], -score[hits]))[0]
+        return int(hits[best])
@@ -0,0 +1,245 @@
+"""
+Multiprocess hand inference for Hand Dance.
+
+InferencePool runs a pool of worker processes, each with its own Hands instance, for one or more cameras
+(sources). Capture threads mirror frames into slots of a shared memory block and only (source, frame
+number, slot) is sent to a worker, which sends back the detected hands as plain arrays. read() returns the
+newest frame of a source straight from its slot. A busy worker keeps only the newest frame of each source
+waiting, frames that are replaced, find no free slot or finish after a newer one are dropped.
+
+Frames from one source always go to the same worker (or the same group of workers when there are more
+workers than sources), so each worker's Hands keeps tracking the same camera.
+"""
+
+import multiprocessing
+import os
+import threading
+import queue
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+
+from tracking import tracked_results
+
+# slots per source: one held by the game, one waiting to be read, two being captured or inferred
+SOURCE_SLOTS = 4
+
+
+def detected_hands(results):
+    # picklable [(label, score, 21 normalized [x, y, z] points)] from MediaPipe results
+    if results.multi_hand_landmarks is None:
+        return []
+    hands = []
+    for hand_landmarks, handedness in zip(results.multi_hand_landmarks, results.multi_handedness):
+        classification = handedness.classification[0]
+        points = np.array([(landmark.x, landmark.y, landmark.z) for landmark in hand_landmarks.landmark], dtype=np.float32)
+        hands.append((classification.label, classification.score, points))
+    return hands
+
+
+def mediapipe_hands(**hands_args):
+    import mediapipe as mp
+    return mp.solutions.hands.Hands(**hands_args)
+
+
+def inference_worker(worker, shm_name, slot_count, shape, tasks, results, hands_factory, hands_args):
+    # runs in its own process, the Hands graph is created here and never leaves it
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray((slot_count,) + shape, dtype=np.uint8, buffer=shm.buf)
+    rgb = np.empty(shape, dtype=np.uint8)
+    hands = hands_factory(**hands_args)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        source, frame_number, slot = task
+        rgb.flags.writeable = True
+        cv.cvtColor(frames[slot], cv.COLOR_BGR2RGB, dst=rgb)
+        rgb.flags.writeable = False
+        results.put((worker, source, frame_number, slot, detected_hands(hands.process(rgb))))
+    hands.close()
+    del frames
+    shm.close()
+
+
+class InferencePool:
+    def __init__(self, caps, width, height, workers=None, hands_factory=mediapipe_hands, max_num_hands=2,
+                 min_detection_confidence=0.7, min_tracking_confidence=0.5):
+        self.caps = list(caps)
+        self.width = width
+        self.height = height
+        self.shape = (height, width, 3)
+        self.worker_count = workers or max(min(os.cpu_count() or 1, 8), 1)
+        self.slot_count = SOURCE_SLOTS * len(self.caps) + self.worker_count
+        frame_bytes = height * width * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slot_count)
+        self.frames = np.ndarray((self.slot_count,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.free_slots = queue.SimpleQueue()
+        for slot in range(self.slot_count):
+            self.free_slots.put(slot)
+
+        # spawn so the workers don't inherit the display, the mixer or the camera
+        context = multiprocessing.get_context("spawn")
+        hands_args = {
+            "max_num_hands" : max_num_hands,
+            "min_detection_confidence" : min_detection_confidence,
+            "min_tracking_confidence" : min_tracking_confidence,
+        }
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(self.worker_count)]
+        self.workers = [
+            context.Process(target=inference_worker, name="hd-inference-%d" % i, daemon=True,
+                            args=(i, self.shm.name, self.slot_count, self.shape, self.tasks[i], self.results, hands_factory, hands_args))
+            for i in range(self.worker_count)
+        ]
+
+        self.cond = threading.Condition()
+        # per worker: whether it has a frame, and the newest frame of each source waiting for it
+        self.busy = [False] * self.worker_count
+        self.pending = [{} for _ in range(self.worker_count)]
+        # per source: newest (frame number, slot, hands) not read yet, and the slot the game is holding
+        self.ready = [None] * len(self.caps)
+        self.held = [None] * len(self.caps)
+        self.delivered = [-1] * len(self.caps)
+        self.finished = [False] * len(self.caps)
+        self.counts = [dict.fromkeys(("captured", "no_slot", "replaced", "inferred", "stale", "read"), 0) for _ in self.caps]
+        self.running = False
+        self.threads = [
+            threading.Thread(target=self.capture_loop, args=(source,), name="hd-capture-%d" % source, daemon=True)
+            for source in range(len(self.caps))
+        ]
+        self.threads.append(threading.Thread(target=self.collect_loop, name="hd-collect", daemon=True))
+
+    def start(self):
+        self.running = True
+        for worker in self.workers:
+            worker.start()
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def worker_for(self, source, frame_number):
+        sources = len(self.caps)
+        if self.worker_count <= sources:
+            return source % self.worker_count
+        # more workers than sources, each source round robins over its own group
+        group = range(source, self.worker_count, sources)
+        return group[frame_number % len(group)]
+
+    def capture_loop(self, source):
+        cap = self.caps[source]
+        frame_number = 0
+        while self.running:
+            ret, image = cap.read()
+            if not ret:
+                break
+            frame_number += 1
+            self.counts[source]["captured"] += 1
+            try:
+                slot = self.free_slots.get_nowait()
+            except queue.Empty:
+                # every slot is busy, inference is behind, so this frame is dropped
+                self.counts[source]["no_slot"] += 1
+                continue
+            if image.shape[:2] != (self.height, self.width):
+                image = cv.resize(image, (self.width, self.height))
+            cv.flip(image, 1, dst=self.frames[slot])  # Mirror display
+            self.dispatch(self.worker_for(source, frame_number), (source, frame_number, slot))
+        with self.cond:
+            self.finished[source] = True
+            self.cond.notify_all()
+
+    def dispatch(self, worker, task):
+        # an idle worker gets the frame now, a busy one keeps only the newest frame of each source waiting
+        source = task[0]
+        with self.cond:
+            if not self.busy[worker]:
+                self.busy[worker] = True
+                self.tasks[worker].put(task)
+                return
+            replaced = self.pending[worker].get(source)
+            self.pending[worker][source] = task
+            if replaced is not None:
+                self.counts[source]["replaced"] += 1
+                self.free_slots.put(replaced[2])
+
+    def collect_loop(self):
+        while self.running:
+            try:
+                worker, source, frame_number, slot, hands = self.results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            with self.cond:
+                # the worker is free, it takes the frame that has waited longest, if any
+                pending = self.pending[worker]
+                if len(pending) > 0:
+                    self.tasks[worker].put(pending.pop(next(iter(pending))))
+                else:
+                    self.busy[worker] = False
+                self.counts[source]["inferred"] += 1
+                ready = self.ready[source]
+                newest = ready[0] if ready is not None else self.delivered[source]
+                if frame_number < newest:
+                    # a worker in the same group finished a newer frame first
+                    self.counts[source]["stale"] += 1
+                    self.free_slots.put(slot)
+                    continue
+                if ready is not None:
+                    self.counts[source]["stale"] += 1
+                    self.free_slots.put(ready[1])
+                self.ready[source] = (frame_number, slot, hands)
+                self.cond.notify_all()
+
+    def read(self, source=0, timeout=0.5):
+        # newest (bgr image, hand results) pair of a source, None once its camera is gone
+        # the image stays valid until the next read of the same source
+        with self.cond:
+            while self.ready[source] is None:
+                if self.finished[source] and self.in_flight(source) == 0:
+                    return None
+                self.cond.wait(timeout)
+            frame_number, slot, hands = self.ready[source]
+            self.ready[source] = None
+            if self.held[source] is not None:
+                self.free_slots.put(self.held[source])
+            self.held[source] = slot
+            self.delivered[source] = frame_number
+            self.counts[source]["read"] += 1
+        return self.frames[slot], tracked_results(hands)
+
+    def read_tagged(self, source=0, timeout=0.5):
+        # same as read, with the source and frame number the result belongs to
+        frame = self.read(source, timeout)
+        if frame is None:
+            return None
+        return source, self.delivered[source], frame[0], frame[1]
+
+    def in_flight(self, source):
+        counts = self.counts[source]
+        return counts["captured"] - counts["no_slot"] - counts["replaced"] - counts["inferred"]
+
+    def stop(self):
+        self.running = False
+        for tasks in self.tasks:
+            tasks.put(None)
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+        for worker in self.workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # the game still holds a view of its last frame, the mapping goes when that does
+            pass
+        self.shm.unlink()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "workers" : self.worker_count,
+                "sources" : [dict(counts) for counts in self.counts]
+            }
@@ -0,0 +1,89 @@
+"""
+Time based judgement for Hand Dance.
+
+Judge grades targets by how far song time in milliseconds is from when they are due, and keeps points,
+combo and counts. Fluid levels (times end with -1) use FLUID_WINDOW_MS, and one frame can hit several of
+their targets. A fluid target due between two frames is judged against the hands interpolated to its time,
+see scoring.TargetTrack. Below the recording's frame rate, a pose held only between two frames can still be
+missed.
+"""
+
+PERFECT = "perfect"
+GOOD = "good"
+MISS = "miss"
+
+# fluid levels (times end with -1) are recorded continuously, so each target only needs to live briefly
+FLUID_WINDOW_MS = 120
+# fraction of the hit window that counts as a perfect hit
+PERFECT_FRACTION = 1 / 3
+# how long the last judgement stays on screen
+JUDGEMENT_DISPLAY_MS = 500
+
+JUDGEMENT_POINTS = {
+    PERFECT : 100,
+    GOOD : 50,
+    MISS : 0
+}
+
+
+def is_fluid(times):
+    return len(times) > 0 and times[-1] == -1
+
+
+class Judge:
+    def __init__(self, window_ms, fluid=False, perfect_ms=None):
+        self.fluid = fluid
+        self.window_ms = FLUID_WINDOW_MS if fluid else window_ms
+        if perfect_ms is None:
+            perfect_ms = int(self.window_ms * PERFECT_FRACTION)
+        self.perfect_ms = perfect_ms
+        self.reset()
+
+    def reset(self):
+        self.points = 0
+        self.combo = 0
+        self.counts = {PERFECT : 0, GOOD : 0, MISS : 0}
+        self.last = None
+        self.last_ms = 0
+
+    def grade(self, target_ms, now_ms):
+        offset = abs(now_ms - target_ms)
+        if offset <= self.perfect_ms:
+            return PERFECT
+        if offset <= self.window_ms:
+            return GOOD
+        return MISS
+
+    def expired(self, target_ms, now_ms):
+        return now_ms - target_ms > self.window_ms
+
+    def fade(self, target_ms, now_ms):
+        # 1.0 when the target is due, 0.0 when its window closes
+        remaining = 1 - (abs(now_ms - target_ms) / self.window_ms)
+        return min(max(remaining, 0.0), 1.0)
+
+    def hit(self, target_ms, now_ms):
+        judgement = self.grade(target_ms, now_ms)
+        if judgement == MISS:
+            self.miss(now_ms)
+            return judgement
+        multiplier = min(self.combo + 1, 10)
+        self.points += JUDGEMENT_POINTS[judgement] * multiplier
+        self.combo += 1
+        self.counts[judgement] += 1
+        self.last = judgement
+        self.last_ms = now_ms
+        return judgement
+
+    def miss(self, now_ms):
+        self.combo = 0
+        self.counts[MISS] += 1
+        self.last = MISS
+        self.last_ms = now_ms
+        return MISS
+
+    def display(self, now_ms):
+        # last judgement text while it is still fresh
+        if self.last is not None and 0 <= now_ms - self.last_ms < JUDGEMENT_DISPLAY_MS:
+            return self.last.upper()
+        return None
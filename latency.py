@@ -0,0 +1,176 @@
+"""
+Latency compensation for Hand Dance.
+
+SongClock follows pygame.mixer.music.get_pos() with time.perf_counter() between updates, never runs
+backwards, and corrects for two per-device latencies:
+
+    song_ms()   where the song is for the player, get_pos() minus the audio output offset
+    pose_ms()   when the hands being judged or recorded were actually in that pose, song_ms() minus the
+                camera to landmark latency
+
+LatencyCalibration measures both: first the player taps [space] along with a click track, which gives
+the audio offset, then touches a box on screen on every click, which gives the camera latency on top of
+it. Results are stored per device profile in devices.json.
+"""
+
+import json
+import statistics
+import time
+
+DEVICES_PATH = "devices.json"
+DEFAULT_DEVICE = "default"
+# get_pos() further than this from the smoothed clock is trusted outright instead of blended in
+RESYNC_MS = 100
+# share of the difference to a new get_pos() reading taken up each time get_pos() moves
+CLOCK_SMOOTHING = 0.1
+
+CALIBRATION_INTERVAL_MS = 750
+CALIBRATION_BEATS = 12
+# the first beats of each phase are for finding the rhythm and aren't measured
+CALIBRATION_WARMUP_BEATS = 2
+AUDIO_PHASE = "audio"
+CAMERA_PHASE = "camera"
+DONE_PHASE = "done"
+
+
+def load_devices(path=DEVICES_PATH):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class SongClock:
+    def __init__(self, music, audio_offset_ms=0, camera_latency_ms=0, timer=time.perf_counter):
+        self.music = music
+        self.audio_offset_ms = audio_offset_ms
+        self.camera_latency_ms = camera_latency_ms
+        self.timer = timer
+        self.start(0)
+
+    def start(self, start_ms=0):
+        # start_ms is where in the song music.play() started
+        self.start_ms = start_ms
+        self.raw = -1
+        self.anchor = None
+        self.position = 0
+
+    def update(self):
+        # once a frame, reads get_pos() and advances the smoothed position
+        raw = self.music.get_pos()
+        if raw < 0:
+            self.raw = raw
+            self.anchor = None
+            return
+        now = self.timer() * 1000
+        if self.anchor is None:
+            self.anchor = (raw, now)
+            self.position = raw
+        else:
+            anchor_ms, anchor_time = self.anchor
+            error = raw - (anchor_ms + now - anchor_time)
+            if abs(error) > RESYNC_MS:
+                self.anchor = (raw, now)
+            elif raw != self.raw:
+                self.anchor = (anchor_ms + error * CLOCK_SMOOTHING, anchor_time)
+        self.raw = raw
+        anchor_ms, anchor_time = self.anchor
+        self.position = max(self.position, anchor_ms + now - anchor_time)
+
+    def song_ms(self):
+        if self.raw < 0:
+            # not playing, same as get_pos() + the start offset used to be
+            return self.raw + self.start_ms
+        return round(self.position - self.audio_offset_ms) + self.start_ms
+
+    def pose_ms(self):
+        if self.raw < 0:
+            return self.raw + self.start_ms
+        return max(self.song_ms() - self.camera_latency_ms, 0)
+
+
+class LatencyCalibration:
+    def __init__(self, audio_offset_ms=0, camera_latency_ms=0, interval_ms=CALIBRATION_INTERVAL_MS, beats=CALIBRATION_BEATS):
+        # the current offsets are kept for a phase the player didn't respond in
+        self.interval_ms = interval_ms
+        self.beats = beats
+        self.phase = None
+        self.phase_start = 0
+        self.beat = -1
+        # when the clicks of the current phase were actually played
+        self.clicks = []
+        self.touching = False
+        self.deltas = {AUDIO_PHASE : [], CAMERA_PHASE : []}
+        self.audio_offset_ms = audio_offset_ms
+        self.camera_latency_ms = camera_latency_ms
+
+    def start(self, now_ms):
+        self.start_phase(AUDIO_PHASE, now_ms)
+
+    def start_phase(self, phase, now_ms):
+        self.phase = phase
+        # the first click is one interval away, so the player has time to get ready
+        self.phase_start = now_ms + self.interval_ms
+        self.beat = -1
+        self.clicks = []
+
+    def beat_time(self, beat):
+        return self.phase_start + beat * self.interval_ms
+
+    def update(self, now_ms):
+        # returns whether a click should be played this frame
+        if self.phase in (None, DONE_PHASE):
+            return False
+        beat = int((now_ms - self.phase_start) // self.interval_ms)
+        if beat >= self.beats:
+            # half an interval after the last click, late responses to it still count
+            if now_ms - self.beat_time(self.beats - 1) >= self.interval_ms / 2:
+                self.finish_phase(now_ms)
+            return False
+        if beat > self.beat and beat >= 0:
+            self.beat = beat
+            self.clicks.append(now_ms)
+            return True
+        return False
+
+    def record(self, phase, now_ms):
+        if self.phase != phase or len(self.clicks) == 0:
+            return
+        # measured against the nearest click as it was played, not as it was scheduled
+        beat = min(range(len(self.clicks)), key=lambda i: abs(now_ms - self.clicks[i]))
+        delta = now_ms - self.clicks[beat]
+        if beat < CALIBRATION_WARMUP_BEATS or abs(delta) > self.interval_ms / 2:
+            return
+        self.deltas[phase].append(delta)
+
+    def tap(self, now_ms):
+        self.record(AUDIO_PHASE, now_ms)
+
+    def touch(self, inside, now_ms):
+        # only the moment the hand enters the box counts
+        if inside and not self.touching:
+            self.record(CAMERA_PHASE, now_ms)
+        self.touching = inside
+
+    def finish_phase(self, now_ms):
+        if self.phase == AUDIO_PHASE:
+            if len(self.deltas[AUDIO_PHASE]) > 0:
+                self.audio_offset_ms = int(statistics.median(self.deltas[AUDIO_PHASE]))
+            self.start_phase(CAMERA_PHASE, now_ms)
+        else:
+            if len(self.deltas[CAMERA_PHASE]) > 0:
+                # touches follow the same click, so they include the audio offset as well
+                self.camera_latency_ms = max(int(statistics.median(self.deltas[CAMERA_PHASE])) - self.audio_offset_ms, 0)
+            self.phase = DONE_PHASE
+
+    def done(self):
+        return self.phase == DONE_PHASE
+
+    def result(self):
+        return {
+            "audio_offset_ms" : self.audio_offset_ms,
+            "camera_latency_ms" : self.camera_latency_ms,
+            "audio_samples" : len(self.deltas[AUDIO_PHASE]),
+            "camera_samples" : len(self.deltas[CAMERA_PHASE])
+        }
@@ -0,0 +1,152 @@
+"""
+Level file loading for Hand Dance.
+
+.hdlevel files are JSON ({"songname", "coords", "times"}). A level can be compiled into a flat binary file
+(.hdlc) next to the JSON, which load_level memory-maps through NumPy whenever it is up to date:
+
+    header      "HDLV", version, hand count, frame count, song name length (little endian)
+    song name   utf-8
+    times       int32[frames]
+    coords      int16[frames, hands, 21, 2]
+
+Convert existing levels with:
+    python levelfile.py levels/*.hdlevel
+"""
+
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b"HDLV"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+DATA_ALIGNMENT = 64
+COMPILED_EXTENSION = ".hdlc"
+LANDMARK_COUNT = 21
+
+
+def compiled_path(path):
+    return os.path.splitext(path)[0] + COMPILED_EXTENSION
+
+
+def coords_array(coords):
+    # (frames, hands, 21, 2), one-handed levels store a single 21 point hand per frame
+    coords = np.asarray(coords, dtype=np.int16)
+    if len(coords) == 0:
+        return coords.reshape(0, 1, LANDMARK_COUNT, 2)
+    if coords.ndim == 3:
+        coords = coords[:, np.newaxis]
+    return coords
+
+
+def game_coords(coords):
+    # the game expects a 21 point hand per frame for one-handed levels and [left, right] for two-handed
+    if coords.shape[1] == 1:
+        return coords[:, 0]
+    return coords
+
+
+def data_offset(song_bytes):
+    offset = HEADER.size + len(song_bytes)
+    return (offset + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT * DATA_ALIGNMENT
+
+
+def write_compiled(path, song_name, times, coords):
+    times = np.asarray(times, dtype=np.int32)
+    coords = coords_array(coords)
+    if len(times) != len(coords):
+        raise ValueError("level has %d times but %d coords" % (len(times), len(coords)))
+
+    song_bytes = song_name.encode("utf-8")
+    offset = data_offset(song_bytes)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, coords.shape[1], len(times), len(song_bytes)))
+        f.write(song_bytes)
+        f.write(b"\0" * (offset - f.tell()))
+        f.write(times.astype("<i4").tobytes())
+        f.write(coords.astype("<i2").tobytes())
+    os.replace(temp_path, path)
+
+
+def read_compiled(path):
+    with open(path, "rb") as f:
+        magic, version, hand_count, frame_count, song_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a compiled level")
+        song_bytes = f.read(song_length)
+
+    offset = data_offset(song_bytes)
+    if frame_count == 0:
+        return song_bytes.decode("utf-8"), np.zeros(0, dtype=np.int32), np.zeros((0, hand_count, LANDMARK_COUNT, 2), dtype=np.int16)
+    times = np.memmap(path, dtype="<i4", mode="r", offset=offset, shape=(frame_count,))
+    coords = np.memmap(path, dtype="<i2", mode="r", offset=offset + times.nbytes, shape=(frame_count, hand_count, LANDMARK_COUNT, 2))
+    return song_bytes.decode("utf-8"), times, coords
+
+
+def read_json(path):
+    with open(path, "r") as f:
+        load_recording = json.load(f)
+    return load_recording["songname"], np.asarray(load_recording["times"], dtype=np.int32), coords_array(load_recording["coords"])
+
+
+def is_current(path, compiled):
+    if not os.path.exists(compiled):
+        return False
+    if not os.path.exists(path):
+        return True
+    return os.path.getmtime(compiled) >= os.path.getmtime(path)
+
+
+def compile_level(path):
+    song_name, times, coords = read_json(path)
+    compiled = compiled_path(path)
+    write_compiled(compiled, song_name, times, coords)
+    return compiled
+
+
+def load_level(path, compile_json=True):
+    # returns (song name, times, coords) with coords in the game's layout, see game_coords
+    compiled = compiled_path(path)
+    if is_current(path, compiled):
+        try:
+            song_name, times, coords = read_compiled(compiled)
+            return song_name, times, game_coords(coords)
+        except (OSError, ValueError, struct.error):
+            print("unable to read compiled level, using " + path)
+
+    song_name, times, coords = read_json(path)
+    if compile_json:
+        try:
+            write_compiled(compiled, song_name, times, coords)
+        except OSError:
+            pass
+    return song_name, times, game_coords(coords)
+
+
+def save_level(path, song_name, times, coords):
+    # recorded levels are always written as JSON, the compiled copy is refreshed alongside it
+    recording_save = {
+        "songname" : song_name,
+        "coords" : coords_array(coords).tolist() if len(coords) > 0 else [],
+        "times" : [int(t) for t in times]
+    }
+    if len(coords) > 0 and np.asarray(coords[0]).ndim == 2:
+        recording_save["coords"] = [hands[0] for hands in recording_save["coords"]]
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(recording_save, json_file, separators=(",", ":"))
+    os.replace(temp_path, path)
+    try:
+        write_compiled(compiled_path(path), song_name, times, coords)
+    except (OSError, ValueError):
+        print("unable to compile level")
+
+
+if __name__ == '__main__':
+    for level_path in sys.argv[1:]:
+        print(level_path + " -> " + compile_level(level_path))
@@ -0,0 +1,164 @@
+"""
+Level library for Hand Dance.
+
+LevelLibrary scans levels/ and songs/ on a background thread and keeps an index of every level (target
+count, hands, duration, song, song length, whether it is fluid, high score and the first pose as a
+preview) in level_index.json, reopening only levels whose modification time or size changed. load()
+parses a level on the same thread and returns a Future.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from judgement import is_fluid
+from levelfile import load_level
+
+LEVEL_INDEX_PATH = "level_index.json"
+LEVEL_EXTENSION = ".hdlevel"
+SONG_EXTENSIONS = (".mp3", ".wav", ".ogg")
+
+
+def level_summary(path, song_meta=None, songs_path=None):
+    song_name, times, coords = load_level(path)
+    song_path = os.path.join(songs_path, song_name) if songs_path is not None else None
+    song_found = song_path is not None and os.path.exists(song_path)
+    song_ms = None
+    if song_found and song_meta is not None:
+        try:
+            song_ms = int(song_meta.lookup(song_path) * 1000)
+        except Exception:
+            print("unable to read song length of " + song_path)
+    return {
+        "targets" : len(times),
+        "hands" : 2 if coords.ndim == 4 else 1,
+        "duration_ms" : int(max(times, default=0)),
+        "song" : song_name,
+        "song_found" : song_found,
+        "song_ms" : song_ms,
+        "fluid" : bool(is_fluid(times)),
+        # first pose, drawn as the menu's preview
+        "preview" : coords[0].tolist() if len(coords) > 0 else None
+    }
+
+
+class LevelLibrary:
+    def __init__(self, levels_path, songs_path, song_meta=None, high_scores=None, index_path=LEVEL_INDEX_PATH):
+        self.levels_path = levels_path
+        self.songs_path = songs_path
+        self.song_meta = song_meta
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            self.levels = index["levels"]
+            self.songs = index["songs"]
+        except (OSError, ValueError, KeyError):
+            self.levels = {}
+            self.songs = []
+        # level name -> high score, copied into the index so the menu doesn't need the score store
+        for name, score in (high_scores or {}).items():
+            if name in self.levels:
+                self.levels[name]["high_score"] = score
+        self.pending_scores = dict(high_scores or {})
+        self.scanning = False
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hd-level-load")
+        self.scanner = None
+
+    def scan(self):
+        # refresh the index in the background, entries() is usable the whole time
+        with self.lock:
+            if self.scanning:
+                return
+            self.scanning = True
+        self.scanner = threading.Thread(target=self.scan_loop, name="hd-level-scan", daemon=True)
+        self.scanner.start()
+
+    def scan_loop(self):
+        try:
+            names = sorted(name for name in os.listdir(self.levels_path) if name.endswith(LEVEL_EXTENSION))
+        except OSError:
+            names = []
+        try:
+            songs = sorted(name for name in os.listdir(self.songs_path) if name.lower().endswith(SONG_EXTENSIONS))
+        except OSError:
+            songs = []
+
+        changed = False
+        for name in names:
+            path = os.path.join(self.levels_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            with self.lock:
+                entry = self.levels.get(name)
+            if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            try:
+                entry = level_summary(path, self.song_meta, self.songs_path)
+            except Exception:
+                print("unable to index " + path)
+                continue
+            entry["mtime"] = stat.st_mtime
+            entry["size"] = stat.st_size
+            with self.lock:
+                entry["high_score"] = self.pending_scores.get(name, self.levels.get(name, {}).get("high_score", 0))
+                self.levels[name] = entry
+            changed = True
+
+        with self.lock:
+            for name in list(self.levels):
+                if name not in names:
+                    del self.levels[name]
+                    changed = True
+            if songs != self.songs:
+                self.songs = songs
+                changed = True
+            self.scanning = False
+        if changed:
+            self.save()
+
+    def entries(self):
+        # [(level name, index entry)] sorted by name
+        with self.lock:
+            return [(name, dict(entry)) for name, entry in sorted(self.levels.items())]
+
+    def song_names(self):
+        with self.lock:
+            return list(self.songs)
+
+    def high_score(self, level_name):
+        with self.lock:
+            entry = self.levels.get(level_name)
+            if entry is None:
+                return self.pending_scores.get(level_name, 0)
+            return entry.get("high_score", 0)
+
+    def record_score(self, level_name, score):
+        with self.lock:
+            self.pending_scores[level_name] = score
+            if level_name in self.levels:
+                self.levels[level_name]["high_score"] = score
+
+    def load(self, level_name):
+        # Future of (song name, times, coords)
+        return self.loader.submit(load_level, os.path.join(self.levels_path, level_name))
+
+    def save(self):
+        with self.lock:
+            index = {"levels" : dict(self.levels), "songs" : list(self.songs)}
+        temp_path = self.index_path + ".tmp"
+        with self.save_lock:
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump(index, f)
+                os.replace(temp_path, self.index_path)
+            except OSError:
+                print("unable to write level index")
+
+    def close(self):
+        self.loader.shutdown(wait=False)
@@ -0,0 +1,105 @@
+"""
+Cached overlay layers for Hand Dance.
+
+OverlayCache.draw(image, function, *args) runs the draw function once for each distinct set of (hashable)
+arguments, keeps what it drew cropped to its area with a mask, and afterwards only does a masked copy onto
+the frame.
+
+OverlayCache.draw_text(image, function, text, coords) does the same for one line of text, rendered into a
+box sized with cv.getTextSize instead of the whole frame, so text that changes every so often, like the
+song clock, is cheap to render again. Text that changes nearly every frame is better drawn directly.
+"""
+
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+OVERLAY_CACHE_SIZE = 64
+TEXT_FONT = cv.FONT_HERSHEY_SIMPLEX
+# anti-aliased edge pixels at least this opaque are kept in the mask
+MASK_COVERAGE = 0.5
+
+
+class OverlayCache:
+    def __init__(self, width, height, capacity=OVERLAY_CACHE_SIZE):
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.layers = OrderedDict()
+        self.black = np.zeros((height, width, 3), dtype=np.uint8)
+        self.white = np.zeros((height, width, 3), dtype=np.uint8)
+        self.renders = 0
+
+    def render(self, draw, args, black, white):
+        # drawing over black and over white recovers both the colour and the coverage of every pixel
+        black[:] = 0
+        white[:] = 255
+        black = draw(black, *args)
+        white = draw(white, *args)
+        self.renders += 1
+
+        # white - black is 255 * (1 - coverage), find the drawn area on that before doing any float work
+        blue, green, red = cv.split(cv.subtract(white, black))
+        uncovered = cv.max(cv.max(blue, green), red)
+        mask = (uncovered <= 255 * (1 - MASK_COVERAGE)).astype(np.uint8)
+        x0, y0, width, height = cv.boundingRect(mask)
+        if width == 0 or height == 0:
+            return None
+        x1, y1 = x0 + width, y0 + height
+
+        # black holds colour * coverage, undo that so edge pixels keep their own colour
+        coverage = 1 - uncovered[y0:y1, x0:x1] / np.float32(255)
+        color = black[y0:y1, x0:x1] / np.maximum(coverage, MASK_COVERAGE)[..., np.newaxis]
+        color = np.clip(color + 0.5, 0, 255).astype(np.uint8)
+        return y0, y1, x0, x1, color, mask[y0:y1, x0:x1] * 255
+
+    def layer(self, key, render):
+        if key in self.layers:
+            self.layers.move_to_end(key)
+            return self.layers[key]
+
+        layer = render()
+        self.layers[key] = layer
+        if len(self.layers) > self.capacity:
+            self.layers.popitem(last=False)
+        return layer
+
+    def text_layer(self, draw, text, coords, scale, thickness):
+        # only the box around the text is rendered, then moved back to where it goes in the frame
+        (width, height), baseline = cv.getTextSize(text, TEXT_FONT, scale, thickness)
+        x0 = max(coords[0] - thickness, 0)
+        y0 = max(coords[1] - height - thickness, 0)
+        x1 = min(coords[0] + width + thickness + 1, self.width)
+        y1 = min(coords[1] + baseline + thickness + 1, self.height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        black = np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        white = np.empty_like(black)
+        layer = self.render(draw, (text, (coords[0] - x0, coords[1] - y0)), black, white)
+        if layer is None:
+            return None
+        top, bottom, left, right, color, mask = layer
+        return top + y0, bottom + y0, left + x0, right + x0, color, mask
+
+    def paste(self, image, layer):
+        if layer is None:
+            return image
+        y0, y1, x0, x1, color, mask = layer
+        cv.copyTo(color, mask, image[y0:y1, x0:x1])
+        return image
+
+    def draw(self, image, draw, *args):
+        # same as draw(image, *args), arguments must be hashable
+        if image.shape[:2] != (self.height, self.width):
+            return draw(image, *args)
+        layer = self.layer((draw,) + args, lambda: self.render(draw, args, self.black, self.white))
+        return self.paste(image, layer)
+
+    def draw_text(self, image, draw, text, coords, scale=1.0, thickness=2):
+        # same as draw(image, text, coords) for a draw function that puts text at coords in TEXT_FONT, no larger
+        # than scale and no thicker than thickness
+        if image.shape[:2] != (self.height, self.width):
+            return draw(image, text, coords)
+        layer = self.layer((draw, text, coords), lambda: self.text_layer(draw, text, coords, scale, thickness))
+        return self.paste(image, layer)
@@ -0,0 +1,143 @@
+"""
+Background persistence for Hand Dance.
+
+BackgroundWriter writes files on its own thread, each to a temporary file renamed over the old one, and
+coalesces writes to the same file so only the newest version is written. HighScoreStore keeps high scores
+per profile and level in a SQLite database (scores.db), read from an in-memory copy and written through
+the BackgroundWriter.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SCORES_PATH = "scores.db"
+DEFAULT_PROFILE = "default"
+
+
+def write_json_atomic(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class BackgroundWriter:
+    def __init__(self):
+        self.cond = threading.Condition()
+        # key -> (function, args), newest wins for a key that hasn't been written yet
+        self.jobs = OrderedDict()
+        self.running = True
+        self.busy = False
+        self.job_count = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self.write_loop, name="hd-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, key, function, *args):
+        # runs function(*args) on the writer thread, replacing a pending job with the same key
+        with self.cond:
+            self.jobs.pop(key, None)
+            self.jobs[key] = (function, args)
+            self.job_count += 1
+            self.cond.notify_all()
+
+    def write_json(self, path, data):
+        # data is copied so the caller can keep changing it
+        self.submit(path, write_json_atomic, path, json.loads(json.dumps(data)))
+
+    def write_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.jobs) > 0 or not self.running)
+                if len(self.jobs) == 0:
+                    return
+                key, (function, args) = self.jobs.popitem(last=False)
+                self.busy = True
+            try:
+                function(*args)
+            except Exception as e:
+                print("unable to write " + str(key) + ": " + str(e))
+            with self.cond:
+                self.busy = False
+                self.written += 1
+                self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        # waits until everything submitted so far has been written
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.jobs) == 0 and not self.busy, timeout)
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+    def stats(self):
+        with self.cond:
+            return {"submitted" : self.job_count, "written" : self.written, "pending" : len(self.jobs)}
+
+
+class HighScoreStore:
+    def __init__(self, writer, path=SCORES_PATH, profile=DEFAULT_PROFILE):
+        self.writer = writer
+        self.path = path
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.scores = {}
+        try:
+            connection = sqlite3.connect(path)
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS scores (profile TEXT, level TEXT, score INTEGER, updated REAL, "
+                                   "PRIMARY KEY (profile, level))")
+            rows = connection.execute("SELECT level, score FROM scores WHERE profile = ?", (profile,)).fetchall()
+            connection.close()
+            self.scores = dict(rows)
+        except sqlite3.Error:
+            print("unable to read high scores")
+        # only used on the writer thread
+        self.connection = None
+
+    def get(self, level_name):
+        with self.lock:
+            return self.scores.get(level_name, 0)
+
+    def all(self):
+        with self.lock:
+            return dict(self.scores)
+
+    def record(self, level_name, score):
+        # returns whether score is a new high score
+        with self.lock:
+            if score <= self.scores.get(level_name, 0):
+                return False
+            self.scores[level_name] = score
+        self.writer.submit(("score", self.profile, level_name), self.write, level_name, score, time.time())
+        return True
+
+    def import_scores(self, scores):
+        # scores from before the store existed, {level name : score}, never lowers a score
+        for level_name, score in scores.items():
+            self.record(level_name, score)
+
+    def write(self, level_name, score, updated):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute("INSERT INTO scores VALUES (?, ?, ?, ?) ON CONFLICT (profile, level) DO UPDATE SET "
+                                    "score = max(score, excluded.score), updated = excluded.updated",
+                                    (self.profile, level_name, score, updated))
+
+    def close(self):
+        self.writer.submit(("close", self.path), self.close_connection)
+
+    def close_connection(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,142 @@
+"""
+Pipelined capture / inference for Hand Dance.
+
+HandPipeline runs the camera read and the MediaPipe inference on their own threads, alongside the game
+loop. Stages hand off through LatestQueue, which only holds the newest item: one that hasn't been picked
+up by the time the next arrives is dropped.
+"""
+
+import threading
+import time
+
+import cv2 as cv
+
+from tracking import AdaptiveHands
+
+
+class LatestQueue:
+    # single slot queue, newest item wins
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.put_count = 0
+        self.get_count = 0
+        self.drop_count = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if self.item is not None:
+                self.drop_count += 1
+            self.item = item
+            self.put_count += 1
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        # returns None on timeout or once closed and drained
+        with self.cond:
+            self.cond.wait_for(lambda: self.item is not None or self.closed, timeout)
+            item = self.item
+            if item is not None:
+                self.item = None
+                self.get_count += 1
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def depth(self):
+        with self.cond:
+            return 0 if self.item is None else 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                "depth" : 0 if self.item is None else 1,
+                "in" : self.put_count,
+                "out" : self.get_count,
+                "dropped" : self.drop_count
+            }
+
+
+class HandPipeline:
+    def __init__(self, cap, width, height, max_num_hands=2, min_detection_confidence=0.7, min_tracking_confidence=0.5,
+                 adaptive=None):
+        self.cap = cap
+        self.width = width
+        self.height = height
+        self.hands_args = {
+            "max_num_hands" : max_num_hands,
+            "min_detection_confidence" : min_detection_confidence,
+            "min_tracking_confidence" : min_tracking_confidence,
+        }
+        # AdaptiveHands arguments, None runs MediaPipe on every frame
+        self.adaptive = adaptive
+        self.frames = LatestQueue()
+        self.results = LatestQueue()
+        self.running = False
+        self.threads = [
+            threading.Thread(target=self.capture_loop, name="hd-capture", daemon=True),
+            threading.Thread(target=self.inference_loop, name="hd-inference", daemon=True),
+        ]
+
+    def start(self):
+        self.running = True
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.frames.close()
+        self.results.close()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+
+    def capture_loop(self):
+        while self.running:
+            ret, image = self.cap.read()
+            if not ret:
+                break
+            if image.shape[:2] != (self.height, self.width):
+                image = cv.resize(image, (self.width, self.height))
+            image = cv.flip(image, 1)  # Mirror display
+            self.frames.put(image)
+        self.frames.close()
+
+    def inference_loop(self):
+        # the Hands graph is created on the thread that uses it
+        import mediapipe as mp
+        hands = mp.solutions.hands.Hands(**self.hands_args)
+        if self.adaptive is not None:
+            hands = AdaptiveHands(hands, **self.adaptive)
+        while self.running:
+            waiting = time.perf_counter()
+            image = self.frames.get(timeout=0.1)
+            if self.adaptive is not None:
+                hands.wait((time.perf_counter() - waiting) * 1000)
+            if image is None:
+                if self.frames.closed:
+                    break
+                continue
+            rgb_image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+            rgb_image.flags.writeable = False
+            results = hands.process(rgb_image)
+            self.results.put((image, results))
+        hands.close()
+        self.results.close()
+
+    def read(self, timeout=0.5):
+        # newest (bgr image, hand results) pair, None once the camera is gone
+        while True:
+            frame = self.results.get(timeout)
+            if frame is not None or self.results.closed:
+                return frame
+
+    def stats(self):
+        return {
+            "capture" : self.frames.stats(),
+            "inference" : self.results.stats()
+        }
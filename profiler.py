@@ -0,0 +1,131 @@
+"""
+Frame stage profiling for Hand Dance.
+
+The main loop calls start_frame(), mark(stage) at the end of each stage and end_frame(). Stage times go
+into a fixed-size ring buffer with a rolling histogram per stage, which feed the live overlay (FPS and
+per-stage milliseconds), percentiles() and export() to CSV or JSON.
+"""
+
+import json
+import time
+
+import numpy as np
+
+STAGES = ("read", "prepare", "inference", "update", "draw", "display")
+PROFILE_FRAMES = 4096
+# frames averaged for the overlay
+OVERLAY_FRAMES = 30
+# how often the overlay text is refreshed
+OVERLAY_REFRESH_MS = 500
+# histogram bucket edges in milliseconds, roughly logarithmic
+HISTOGRAM_EDGES = np.array([0, 0.25, 0.5, 1, 2, 4, 8, 12, 16, 20, 25, 33, 40, 50, 67, 100, 200, np.inf], dtype=np.float32)
+
+
+class FrameProfiler:
+    def __init__(self, stages=STAGES, capacity=PROFILE_FRAMES):
+        self.stages = stages
+        self.columns = stages + ("frame",)
+        self.stage_index = {stage : i for i, stage in enumerate(stages)}
+        self.capacity = capacity
+        # milliseconds per stage, one row per frame, the last column is the whole frame
+        self.samples = np.zeros((capacity, len(self.columns)), dtype=np.float32)
+        self.histogram = np.zeros((len(self.columns), len(HISTOGRAM_EDGES) - 1), dtype=np.int64)
+        self.column_range = np.arange(len(self.columns))
+        self.frame_count = 0
+        self.frame_start = 0
+        self.last_mark = 0
+        self.overlay_text = ()
+        self.overlay_time = 0
+
+    def start_frame(self):
+        self.frame_start = self.last_mark = time.perf_counter_ns()
+        slot = self.frame_count % self.capacity
+        if self.frame_count >= self.capacity:
+            # the frame about to be overwritten leaves the rolling histogram
+            self.histogram[self.column_range, self.buckets(self.samples[slot])] -= 1
+        self.samples[slot] = 0
+
+    def mark(self, stage):
+        now = time.perf_counter_ns()
+        self.samples[self.frame_count % self.capacity, self.stage_index[stage]] += (now - self.last_mark) / 1e6
+        self.last_mark = now
+
+    def end_frame(self):
+        slot = self.frame_count % self.capacity
+        self.samples[slot, -1] = (time.perf_counter_ns() - self.frame_start) / 1e6
+        self.histogram[self.column_range, self.buckets(self.samples[slot])] += 1
+        self.frame_count += 1
+
+    def stage_ms(self, stage):
+        # time so far in stage on the current frame
+        return float(self.samples[self.frame_count % self.capacity, self.stage_index[stage]])
+
+    def busy_ms(self):
+        # the last frame's time minus the read stage, what the frame cost rather than how long it waited for the camera
+        if self.frame_count == 0:
+            return None
+        row = self.samples[(self.frame_count - 1) % self.capacity]
+        return float(row[-1] - row[self.stage_index["read"]])
+
+    def buckets(self, row):
+        return np.searchsorted(HISTOGRAM_EDGES, row, side="right") - 1
+
+    def recent(self, frames=None):
+        # recorded frames, oldest first
+        if self.frame_count <= self.capacity:
+            samples = self.samples[:self.frame_count]
+        else:
+            start = self.frame_count % self.capacity
+            samples = np.concatenate((self.samples[start:], self.samples[:start]))
+        if frames is not None:
+            samples = samples[-frames:]
+        return samples
+
+    def percentiles(self, quantiles=(50, 95, 99)):
+        samples = self.recent()
+        summary = {}
+        for i, stage in enumerate(self.columns):
+            if len(samples) == 0:
+                summary[stage] = {"p%d" % q : 0.0 for q in quantiles}
+            else:
+                values = np.percentile(samples[:, i], quantiles)
+                summary[stage] = {"p%d" % q : float(value) for q, value in zip(quantiles, values)}
+        return summary
+
+    def averages(self, frames=OVERLAY_FRAMES):
+        samples = self.recent(frames)
+        if len(samples) == 0:
+            return dict.fromkeys(self.columns, 0.0)
+        return dict(zip(self.columns, samples.mean(axis=0).tolist()))
+
+    def overlay_lines(self):
+        # text for the live overlay, only refreshed every OVERLAY_REFRESH_MS so it can be cached
+        now = time.perf_counter_ns() // 1000000
+        if now - self.overlay_time >= OVERLAY_REFRESH_MS:
+            averages = self.averages()
+            fps = 1000 / averages["frame"] if averages["frame"] > 0 else 0
+            self.overlay_text = ("FPS %.1f" % fps,) + tuple("%s %.1f ms" % (stage, averages[stage]) for stage in self.columns)
+            self.overlay_time = now
+        return self.overlay_text
+
+    def export(self, path):
+        # .json writes the trace with histograms, anything else is written as CSV
+        samples = self.recent()
+        first_frame = self.frame_count - len(samples)
+        if path.endswith(".json"):
+            trace = {
+                "stages" : list(self.columns),
+                "first_frame" : first_frame,
+                "frames_ms" : np.round(samples, 3).tolist(),
+                "percentiles" : self.percentiles(),
+                "histogram_edges_ms" : [float(edge) for edge in HISTOGRAM_EDGES[:-1]],
+                "histograms" : {stage : self.histogram[i].tolist() for i, stage in enumerate(self.columns)}
+            }
+            with open(path, "w") as f:
+                json.dump(trace, f)
+        else:
+            with open(path, "w") as f:
+                f.write(",".join(("frame_number",) + self.columns) + "\n")
+                for i, row in enumerate(samples):
+                    f.write(str(first_frame + i) + "," + ",".join("%.3f" % value for value in row) + "\n")
+
@@ -0,0 +1,184 @@
+"""
+Streaming level recorder for Hand Dance.
+
+StreamingRecorder keeps a take in int16 arrays laid out like a compiled level (frames, hands, 21, 2),
+growing them by doubling, and appends every CHUNK_FRAMES frames to a journal file (.hdrec) on a background
+thread. Poses within a pixel tolerance of the last pose kept can be dropped as they come in.
+
+A journal left behind by a crash is turned back into a level with:
+    python recorder.py levels/my_level.hdrec
+"""
+
+import os
+import queue
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from levelfile import LANDMARK_COUNT, game_coords, save_level
+
+MAGIC = b"HDRC"
+VERSION = 1
+# magic, version, hand count, song name length
+HEADER = struct.Struct("<4sHHH")
+# frames in the chunk that follows
+CHUNK_HEADER = struct.Struct("<I")
+JOURNAL_EXTENSION = ".hdrec"
+CHUNK_FRAMES = 256
+INITIAL_FRAMES = 1024
+# a pose is kept at least this often even when the hands haven't moved
+MAX_GAP_MS = 250
+
+
+def journal_path(level_path):
+    return os.path.splitext(level_path)[0] + JOURNAL_EXTENSION
+
+
+class StreamingRecorder:
+    def __init__(self, level_path, song_name, hands=1, tolerance=0, capacity=INITIAL_FRAMES):
+        self.level_path = level_path
+        self.song_name = song_name
+        self.hands = hands
+        # poses whose landmarks all moved by at most this many pixels since the last kept pose are dropped
+        self.tolerance = tolerance
+        self.times = np.zeros(capacity, dtype=np.int32)
+        self.coords = np.zeros((capacity, hands, LANDMARK_COUNT, 2), dtype=np.int16)
+        self.count = 0
+        self.flushed = 0
+        self.seen = 0
+
+        self.journal = journal_path(level_path)
+        self.chunks = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, name="hd-recorder", daemon=True)
+        song_bytes = song_name.encode("utf-8")
+        self.chunks.put(HEADER.pack(MAGIC, VERSION, hands, len(song_bytes)) + song_bytes)
+        self.writer.start()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, time_ms, pose):
+        # pose is a hand, or [left, right] when recording two hands, returns whether it was kept
+        self.seen += 1
+        pose = np.asarray(pose, dtype=np.int16).reshape(self.hands, LANDMARK_COUNT, 2)
+        # the -1 that ends a continuous recording is never dropped, it is what makes the level fluid
+        if self.tolerance > 0 and self.count > 0 and time_ms >= 0:
+            last = self.count - 1
+            if time_ms - self.times[last] < MAX_GAP_MS and np.abs(pose - self.coords[last]).max() <= self.tolerance:
+                return False
+
+        if self.count == len(self.times):
+            self.grow()
+        self.times[self.count] = time_ms
+        self.coords[self.count] = pose
+        self.count += 1
+        if self.count - self.flushed >= CHUNK_FRAMES:
+            self.flush()
+        return True
+
+    def grow(self):
+        capacity = len(self.times) * 2
+        times = np.zeros(capacity, dtype=np.int32)
+        coords = np.zeros((capacity,) + self.coords.shape[1:], dtype=np.int16)
+        times[:self.count] = self.times[:self.count]
+        coords[:self.count] = self.coords[:self.count]
+        self.times = times
+        self.coords = coords
+
+    def flush(self):
+        if self.count == self.flushed:
+            return
+        start, end = self.flushed, self.count
+        self.chunks.put(CHUNK_HEADER.pack(end - start) + self.times[start:end].astype("<i4").tobytes()
+                        + self.coords[start:end].astype("<i2").tobytes())
+        self.flushed = end
+
+    def write_loop(self):
+        try:
+            with open(self.journal, "wb") as f:
+                while True:
+                    chunk = self.chunks.get()
+                    if chunk is None:
+                        break
+                    f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError:
+            print("unable to write recording journal")
+
+    def close(self):
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+
+    def finish(self):
+        # (times, coords) in the game's layout, the journal stays until the level has been saved
+        self.close()
+        return self.times[:self.count].copy(), game_coords(self.coords[:self.count].copy())
+
+    def save(self, times, coords):
+        # writes the level, then drops the journal that was protecting it
+        save_level(self.level_path, self.song_name, times, coords)
+        self.remove_journal()
+
+    def discard(self):
+        self.close()
+        self.remove_journal()
+
+    def remove_journal(self):
+        try:
+            os.remove(self.journal)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            "seen" : self.seen,
+            "kept" : self.count,
+            "bytes" : self.times[:self.count].nbytes + self.coords[:self.count].nbytes
+        }
+
+
+def read_journal(path):
+    # (song name, times, coords) from a journal, a chunk cut short by a crash is ignored
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, hands, song_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(path + " is not a recording journal")
+    offset = HEADER.size
+    song_name = data[offset:offset + song_length].decode("utf-8")
+    offset += song_length
+
+    times = []
+    coords = []
+    pose_bytes = hands * LANDMARK_COUNT * 2 * 2
+    while offset + CHUNK_HEADER.size <= len(data):
+        frames = CHUNK_HEADER.unpack_from(data, offset)[0]
+        start = offset + CHUNK_HEADER.size
+        end = start + frames * (4 + pose_bytes)
+        if end > len(data):
+            break
+        times.append(np.frombuffer(data, dtype="<i4", count=frames, offset=start))
+        coords.append(np.frombuffer(data, dtype="<i2", count=frames * hands * LANDMARK_COUNT * 2, offset=start + frames * 4)
+                      .reshape(frames, hands, LANDMARK_COUNT, 2))
+        offset = end
+
+    if len(times) == 0:
+        return song_name, np.zeros(0, dtype=np.int32), np.zeros((0, hands, LANDMARK_COUNT, 2), dtype=np.int16)
+    return song_name, np.concatenate(times).astype(np.int32), np.concatenate(coords).astype(np.int16)
+
+
+def recover(path):
+    song_name, times, coords = read_journal(path)
+    level_path = os.path.splitext(path)[0] + ".hdlevel"
+    save_level(level_path, song_name, times, game_coords(coords))
+    return level_path, len(times)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        level_path, frames = recover(path)
+        print("%s -> %s (%d frames)" % (path, level_path, frames))
@@ -0,0 +1,51 @@
+"""
+Target scheduling for Hand Dance.
+
+TargetScheduler keeps a level's times as a sorted array and releases every target that has come due since
+the last call, optionally a lookahead interval early. It can seek to any song position for practicing a
+section.
+"""
+
+import numpy as np
+
+
+def spawn_times(times):
+    # fluid levels end with a -1 marker, which is due right after the target before it
+    times = np.asarray(times, dtype=np.int64)
+    if len(times) == 0:
+        return times
+    return np.maximum.accumulate(np.maximum(times, 0))
+
+
+class TargetScheduler:
+    def __init__(self, times, lookahead_ms=0):
+        self.times = spawn_times(times)
+        self.lookahead_ms = lookahead_ms
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def reset(self):
+        self.cursor = 0
+
+    def seek(self, song_ms):
+        # skip every target due before song_ms
+        self.cursor = int(np.searchsorted(self.times, song_ms, side="left"))
+
+    def due(self, song_ms):
+        # indices of every target that should be on screen by song_ms and hasn't been released yet
+        if self.done() or self.times[self.cursor] >= song_ms + self.lookahead_ms:
+            # most game steps release nothing
+            return range(self.cursor, self.cursor)
+        end =int(np.searchsorted(self.times, song_ms + self.lookahead_ms, side="left"))
+        end = max(end, self.cursor)
+        released = range(self.cursor, end)
+        self.cursor = end
+        return released
+
+    def time(self, index):
+        return int(self.times[index])
+
+    def done(self):
+        return self.cursor >= len(self.times)
@@ -0,0 +1,390 @@
+"""
+Scoring for Hand Dance, live and offline.
+
+TargetTrack holds the targets of one play-through: the scheduler releasing them, the ones on screen and the
+Judge grading them. engine.GameEngine drives it live and score_stream from a recorded landmark stream, with
+the same result, so a session can be rescored with a different hit_tolerance or hit_window.
+
+A landmark stream is a dict of per-frame arrays, frame 0 being the frame the song was started on:
+
+    song_ms     song position as heard, used to release targets
+    pose_ms     when the hands of that frame were in that pose, used to grade and expire targets
+    left        int16 [frames, 21, 2] pixel landmarks, has_left says which frames have a left hand
+    right       int16 [frames, 21, 2], has_right
+    hit_ms      optional, the pose_ms the hit test used when it was read before pose_ms
+    start_ms    optional, where in the song the session started (practice mode)
+
+stream_from_level builds the stream of a player matching a level perfectly (what bench.py plays),
+save_stream saves one and telemetry logs (see telemetry.py) load as streams too. explain_misses says why
+each missed target was missed, level_metrics computes per level difficulty numbers.
+
+Rescore or analyze from the command line, every level/session and tolerance runs in its own process:
+    python scoring.py                                  every level, with the settings in preferences.json
+    python scoring.py --tolerance 20 30 40 50 --report report.json
+    python scoring.py --sessions sessions/*.npz levels/alphabet.hdlevel
+    python scoring.py --sessions telemetry/*.hdtl --explain
+"""
+
+import argparse
+import glob
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from hitmatch import FINGERTIPS, HandMatcher
+from judgement import MISS, PERFECT, Judge, is_fluid
+from levelfile import LANDMARK_COUNT, load_level
+from scheduler import TargetScheduler, spawn_times
+from telemetry import TELEMETRY_EXTENSION, read_telemetry, telemetry_stream
+
+# the landmarks used for hand travel, wrist and fingertips
+TRAVEL_LANDMARKS = (0,) + FINGERTIPS
+# window for the peak target density
+DENSITY_WINDOW_MS = 5000
+PREFERENCES_PATH = "preferences.json"
+STREAM_KEYS = ("song_ms", "pose_ms", "left", "right", "has_left", "has_right")
+# a miss whose hands were found for less than this share of the target's frames on screen was undetected
+DETECTED_SHARE = 0.5
+# targets are released and expired in steps of this much song time, whatever the frame rate
+TICK_MS = 4
+
+
+def interpolate_hand(start, end, weight):
+    # the hand between two observations, weight 0 being start and 1 end
+    if len(start) == 0 or len(end) == 0:
+        return []
+    start = np.asarray(start, dtype=np.float32)
+    return (start + (np.asarray(end, dtype=np.float32) - start) * weight).tolist()
+
+
+class TargetTrack:
+    def __init__(self, times, coords, hit_window, matcher, lookahead_ms=0, start_ms=0):
+        self.coords = coords
+        self.judge = Judge(hit_window, is_fluid(times))
+        if self.judge.fluid:
+            # fluid targets can be hit from the start of their perfect band
+            lookahead_ms = max(lookahead_ms, self.judge.perfect_ms)
+        self.scheduler = TargetScheduler(times, lookahead_ms)
+        self.scheduler.seek(start_ms)
+        self.matcher = matcher
+        # targets on screen, oldest first, and their indices in the level
+        self.target_times = deque()
+        self.target_coords = deque()
+        self.target_indices = deque()
+        # (left, right, pose_ms) of the last hit test, fluid targets due since then are judged between the two
+        self.previous = None
+        # song time of the last step
+        self.ticked_ms = None
+
+    def hit(self, left_hand, right_hand, pose_ms):
+        # judges the best matching target on screen, returns the judgement or None
+        previous = self.previous
+        self.previous = (left_hand, right_hand, pose_ms)
+        if len(self.target_coords) == 0:
+            return None
+        if self.judge.fluid:
+            hits = self.fluid_hits(previous, left_hand, right_hand, pose_ms)
+        else:
+            target_index = self.matcher.match(left_hand, right_hand, self.target_coords)
+            hits = [] if target_index is None else [(target_index, pose_ms)]
+        # targets released early by the lookahead can't be hit until they are inside the hit window
+        hits = [(i, hit_ms) for i, hit_ms in hits if self.judge.grade(self.target_times[i], hit_ms) != MISS]
+        if len(hits) == 0:
+            return None
+        judgements = [self.judge.hit(self.target_times[i], hit_ms) for i, hit_ms in hits]
+        for i, _ in reversed(hits):
+            del self.target_coords[i]
+            del self.target_times[i]
+            del self.target_indices[i]
+        return PERFECT if PERFECT in judgements else judgements[0]
+
+    def fluid_hits(self, previous, left_hand, right_hand, pose_ms):
+        # [(target, when it was hit)] in order, consecutive poses of a fluid level are close, so one pose hits
+        # every target it matches however many frames apart they were recorded
+        hits = {}
+        if previous is not None and previous[2] < pose_ms:
+            previous_left, previous_right, previous_ms = previous
+            # a target due since the last hit test is compared with the hands interpolated to its own time, as if
+            # a frame had been taken then
+            for i, target_ms in enumerate(self.target_times):
+                if not previous_ms < target_ms <= pose_ms:
+                    continue
+                weight = (target_ms - previous_ms) / (pose_ms - previous_ms)
+                left = interpolate_hand(previous_left, left_hand, weight)
+                right = interpolate_hand(previous_right, right_hand, weight)
+                if len(self.matcher.matches(left, right, [self.target_coords[i]])) > 0:
+                    hits[i] = target_ms
+        # the rest are compared with the hands as they are now
+        for i in self.matcher.matches(left_hand, right_hand, self.target_coords):
+            hits.setdefault(i, pose_ms)
+        return sorted(hits.items())
+
+    def advance(self, song_ms, latency_ms=0):
+        # steps through song time up to song_ms, each step releasing the targets due by then and expiring the
+        # ones whose window has closed by then less latency_ms, returns the indices of the missed targets
+        missed = []
+        if self.ticked_ms is None:
+            self.ticked_ms = song_ms - song_ms % TICK_MS - TICK_MS
+        while self.ticked_ms + TICK_MS <= song_ms:
+            self.ticked_ms += TICK_MS
+            self.spawn(self.ticked_ms)
+            missed += self.expire(max(self.ticked_ms - latency_ms, 0))
+        return missed
+
+    def spawn(self, song_ms):
+        for target_index in self.scheduler.due(song_ms):
+            self.target_coords.append(self.coords[target_index])
+            self.target_times.append(self.scheduler.time(target_index))
+            self.target_indices.append(target_index)
+
+    def expire(self, pose_ms):
+        # misses every target that has left the hit window, returns their indices in the level
+        missed = []
+        while len(self.target_times) > 0 and self.judge.expired(self.target_times[0], pose_ms):
+            self.judge.miss(pose_ms)
+            self.target_coords.popleft()
+            self.target_times.popleft()
+            missed.append(self.target_indices.popleft())
+        return missed
+
+    def result(self):
+        return {"points" : self.judge.points, "judgements" : dict(self.judge.counts)}
+
+
+def score_stream(times, coords, stream, hit_window, matcher, lookahead_ms=0, start_ms=0):
+    # same order as an update of GameEngine: step up to the frame's song time, then hit
+    track = TargetTrack(times, coords, hit_window, matcher, lookahead_ms, start_ms)
+    left = stream["left"].tolist()
+    right = stream["right"].tolist()
+    song_ms = stream["song_ms"].tolist()
+    pose_ms = stream["pose_ms"].tolist()
+    hit_ms = stream.get("hit_ms", stream["pose_ms"]).tolist()
+    for frame in range(len(song_ms)):
+        track.advance(song_ms[frame], song_ms[frame] - pose_ms[frame])
+        # the hands that pressed start aren't judged
+        if frame > 0 and stream["has_right"][frame]:
+            track.hit(left[frame] if stream["has_left"][frame] else [], right[frame], hit_ms[frame])
+    return track.result()
+
+
+def simulated_times(frames, fps, start_frame=1):
+    # song position on each frame as SimulatedClock gives it when the song starts on start_frame
+    frame_ms = 1000 / fps
+    now = (np.arange(start_frame, start_frame + frames) * frame_ms).astype(np.int64)
+    return now - now[0]
+
+
+def stream_from_level(times, coords, fps=30, length_ms=None, tail_ms=2000):
+    # a player holding each recorded pose from the moment it is due until the next one
+    times = np.asarray(times)
+    coords = np.asarray(coords)
+    if length_ms is None:
+        length_ms = int(max(times, default=0)) + tail_ms
+    frames = int(length_ms * fps / 1000) + 1
+    song_ms = simulated_times(frames, fps)
+    song_ms = song_ms[song_ms < length_ms]
+    frames = len(song_ms)
+
+    pose_index = np.searchsorted(spawn_times(times), song_ms, side="left") - 1
+    posed = pose_index >= 0
+    left = np.zeros((frames, LANDMARK_COUNT, 2), dtype=np.int16)
+    right = np.zeros((frames, LANDMARK_COUNT, 2), dtype=np.int16)
+    if coords.ndim == 4:
+        left[posed] = coords[pose_index[posed], 0]
+        right[posed] = coords[pose_index[posed], 1]
+        has_left = posed.copy()
+    else:
+        right[posed] = coords[pose_index[posed]]
+        has_left = np.zeros(frames, dtype=bool)
+    return {"song_ms" : song_ms, "pose_ms" : song_ms.copy(), "left" : left, "right" : right,
+            "has_left" : has_left, "has_right" : posed.copy()}
+
+
+def save_stream(path, stream, level_name=""):
+    np.savez_compressed(path, level=np.array(level_name), **stream)
+
+
+def load_stream(path):
+    # (level name, stream) from a saved stream or a telemetry log
+    if path.endswith(TELEMETRY_EXTENSION):
+        settings, records = read_telemetry(path)
+        return settings.get("level", ""), telemetry_stream(records, settings.get("start_ms", 0))
+    with np.load(path) as data:
+        stream = {key : data[key] for key in STREAM_KEYS + ("hit_ms", "start_ms") if key in data}
+        level_name = str(data["level"]) if "level" in data else ""
+    return level_name, stream
+
+
+def explain_misses(times, coords, stream, hit_window, matcher, lookahead_ms=0, start_ms=0):
+    # replays a stream like score_stream, [(level index, target ms, reason, best score, closest mean distance)]
+    # for every missed target, reason being "undetected", "tolerance" or "timing"
+    track = TargetTrack(times, coords, hit_window, matcher, lookahead_ms, start_ms)
+    two_handed = np.asarray(coords).ndim == 4
+    left = stream["left"].tolist()
+    right = stream["right"].tolist()
+    song_ms = stream["song_ms"].tolist()
+    pose_ms = stream["pose_ms"].tolist()
+    hit_ms = stream.get("hit_ms", stream["pose_ms"]).tolist()
+    # level index -> [frames on screen, frames the hands were found, best score, closest mean distance]
+    seen = {}
+    misses = []
+    for frame in range(len(song_ms)):
+        left_hand = left[frame] if stream["has_left"][frame] else []
+        right_hand = right[frame] if stream["has_right"][frame] else []
+        detected = len(right_hand) > 0 and (len(left_hand) > 0 or not two_handed)
+        for target_index in track.advance(song_ms[frame], song_ms[frame] - pose_ms[frame]):
+            frames, found, best_score, closest = seen.get(target_index, [0, 0, 0.0, np.inf])
+            if frames == 0 or found < frames * DETECTED_SHARE:
+                reason = "undetected"
+            elif best_score < matcher.required - 1e-6:
+                reason = "tolerance"
+            else:
+                # matched, but only while the target was outside the hit window
+                reason = "timing"
+            misses.append((target_index, track.scheduler.time(target_index), reason, best_score, closest))
+        if frame > 0 and len(track.target_coords) > 0:
+            if detected:
+                score, mean_distance = matcher.scores(left_hand, right_hand, track.target_coords)
+            for i, target_index in enumerate(track.target_indices):
+                target = seen.setdefault(target_index, [0, 0, 0.0, np.inf])
+                target[0] += 1
+                if detected:
+                    target[1] += 1
+                    target[2] = max(target[2], float(score[i]))
+                    target[3] = min(target[3], float(mean_distance[i]))
+        if frame > 0 and len(right_hand) > 0:
+            track.hit(left_hand, right_hand, hit_ms[frame])
+    return misses
+
+
+def level_metrics(times, coords):
+    times = spawn_times(times)
+    coords = np.asarray(coords, dtype=np.float32)
+    if coords.ndim == 3:
+        coords = coords[:, np.newaxis]
+    duration_ms = int(times[-1]) if len(times) > 0 else 0
+    metrics = {
+        "targets" : len(times),
+        "hands" : coords.shape[1] if len(coords) > 0 else 0,
+        "duration_ms" : duration_ms,
+        "density" : len(times) * 1000 / duration_ms if duration_ms > 0 else 0.0,
+        "peak_density" : 0.0,
+        "pose_variance" : 0.0,
+        "travel_px" : 0.0,
+        "peak_speed" : 0.0
+    }
+    if len(times) < 2:
+        return metrics
+
+    # most targets due in any DENSITY_WINDOW_MS, per second
+    window_end = np.searchsorted(times, times + DENSITY_WINDOW_MS, side="left")
+    metrics["peak_density"] = float((window_end - np.arange(len(times))).max() * 1000 / DENSITY_WINDOW_MS)
+    # spread of each landmark over the level, in pixels squared
+    metrics["pose_variance"] = float(coords.var(axis=0).sum(axis=-1).mean())
+    # distance the wrist and fingertips have to move from one target to the next
+    points = coords[:, :, TRAVEL_LANDMARKS]
+    step = np.linalg.norm(np.diff(points, axis=0), axis=-1).mean(axis=(1, 2))
+    metrics["travel_px"] = float(step.sum())
+    # fastest move between consecutive targets, in pixels per second
+    gap = np.maximum(np.diff(times), 1)
+    metrics["peak_speed"] = float((step * 1000 / gap).max())
+    return metrics
+
+
+def scoring_preferences(path=PREFERENCES_PATH):
+    # the scoring settings main() would play with
+    try:
+        with open(path, "r") as f:
+            preferences = json.load(f)
+    except (OSError, ValueError):
+        preferences = {}
+    return {
+        "tolerance" : preferences.get("hit_tolerance", 50),
+        "hit_window" : preferences.get("hit_window", preferences.get("hit_interval", 30) * 1000 // 30),
+        "landmarks" : preferences.get("hit_landmarks", FINGERTIPS),
+        "weights" : preferences.get("hit_weights"),
+        "lookahead_ms" : preferences.get("lookahead_ms", 0)
+    }
+
+
+def score_job(job):
+    # runs in a worker process
+    level_path, session_path, tolerance, settings, fps = job
+    _, times, coords = load_level(level_path)
+    if session_path is None:
+        stream = stream_from_level(times, coords, fps)
+    else:
+        _, stream = load_stream(session_path)
+    matcher = HandMatcher(tolerance, settings["landmarks"], settings["weights"])
+    hit_window = settings["hit_window"]
+    start_ms = int(stream.get("start_ms", 0))
+    result = score_stream(times, coords, stream, hit_window, matcher, settings["lookahead_ms"], start_ms)
+    if session_path is not None and settings.get("explain"):
+        misses = explain_misses(times, coords, stream, hit_window, matcher, settings["lookahead_ms"], start_ms)
+        result["misses"] = [{"target" : int(target_index), "time_ms" : target_ms, "reason" : reason, "score" : best_score,
+                             "distance" : closest if np.isfinite(closest) else None}
+                            for target_index, target_ms, reason, best_score, closest in misses]
+    result.update({"level" : os.path.basename(level_path), "session" : session_path, "tolerance" : tolerance, "hit_window" : hit_window})
+    return result
+
+
+def metrics_job(level_path):
+    _, times, coords = load_level(level_path)
+    metrics = level_metrics(times, coords)
+    metrics["level"] = os.path.basename(level_path)
+    return metrics
+
+
+def run_jobs(levels, sessions, tolerances, settings, fps=30, workers=None, levels_path="levels"):
+    # every level is replayed perfectly and every session rescored once per tolerance
+    jobs = [(level, None, tolerance, settings, fps) for level in levels for tolerance in tolerances]
+    for session in sessions:
+        level_name, _ = load_stream(session)
+        level_path = os.path.join(levels_path, level_name)
+        jobs += [(level_path, session, tolerance, settings, fps) for tolerance in tolerances]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        scores = list(pool.map(score_job, jobs))
+        metrics = list(pool.map(metrics_job, levels))
+    return {"scores" : scores, "levels" : metrics}
+
+
+def print_report(report):
+    for metrics in report["levels"]:
+        print("%s: %d targets, %.2f/s (peak %.2f/s), pose variance %.0f, travel %.0f px (peak %.0f px/s)" % (
+            metrics["level"], metrics["targets"], metrics["density"], metrics["peak_density"], metrics["pose_variance"],
+            metrics["travel_px"], metrics["peak_speed"]))
+    for result in report["scores"]:
+        source = result["session"] or "perfect replay"
+        print("    %s (%s) tolerance %d: %d points %s" % (result["level"], source, result["tolerance"], result["points"], result["judgements"]))
+        for miss in result.get("misses", []):
+            distance = "--" if miss["distance"] is None else "%.0f px" % miss["distance"]
+            print("        missed target %d at %d ms: %s (best match %.0f%%, closest %s)" % (
+                miss["target"], miss["time_ms"], miss["reason"], miss["score"] * 100, distance))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline Hand Dance scoring and level analytics")
+    parser.add_argument("levels", nargs="*", help="level files, defaults to every level in levels/")
+    parser.add_argument("--sessions", nargs="*", default=[], help="recorded landmark streams (.npz) or telemetry logs (.hdtl) to rescore")
+    parser.add_argument("--explain", action="store_true", help="say why each target of a session was missed")
+    parser.add_argument("--tolerance", nargs="+", type=int, help="hit tolerances in pixels to score with, defaults to the preference")
+    parser.add_argument("--window", type=int, help="hit window in milliseconds, defaults to the preference")
+    parser.add_argument("--fps", type=int, default=30, help="frame rate of the perfect replay")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to one per core")
+    parser.add_argument("--report", help="also write the report to this file")
+    args = parser.parse_args()
+
+    settings = scoring_preferences()
+    if args.window is not None:
+        settings["hit_window"] = args.window
+    settings["explain"] = args.explain
+    tolerances = args.tolerance or [settings["tolerance"]]
+    levels = args.levels or ([] if args.sessions else sorted(glob.glob("levels/*.hdlevel")))
+    report = run_jobs(levels, args.sessions, tolerances, settings, args.fps, args.workers)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,115 @@
+"""
+Setlists for Hand Dance.
+
+Setlist plays a list of level file names back to back, from the "setlist" preference or
+main(setlist=...). While a level plays, the next one is prefetched on a background thread: the level, its
+song file read into memory and the song length. A level that can't be loaded is replaced by the default
+level. summary() gives every level's score and the total.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from judgement import JUDGEMENT_POINTS
+from levelfile import load_level
+
+DEFAULT_LEVEL = "default.hdlevel"
+
+def prefetch_level(levels_path, songs_path, level_name, song_meta=None):
+    # (song name, times, coords, song file in memory or None)
+    song_name, times, coords = load_level(os.path.join(levels_path, level_name))
+    song_path = os.path.join(songs_path, song_name)
+    try:
+        with open(song_path, "rb") as f:
+            song_file = f.read()
+    except OSError:
+        print("unable to read song " + song_path)
+        song_file = None
+    if song_meta is not None and song_file is not None:
+        try:
+            song_meta.lookup(song_path)
+        except Exception:
+            print("unable to read song length of " + song_path)
+    return song_name, times, coords, song_file
+
+
+class Setlist:
+    def __init__(self, levels, levels_path, songs_path, song_meta=None):
+        self.levels = list(levels)
+        self.levels_path = levels_path
+        self.songs_path = songs_path
+        self.song_meta = song_meta
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hd-setlist")
+        # the level actually played for each entry, DEFAULT_LEVEL when the entry couldn't be loaded
+        self.played = list(self.levels)
+        # index -> Future of prefetch_level
+        self.prefetched = {}
+        self.position = 0
+        # one result per level played, in order
+        self.results = []
+
+    def __len__(self):
+        return len(self.levels)
+
+    def level_name(self):
+        return self.played[self.position]
+
+    def load(self, index):
+        # prefetch_level for entry index, falling back to the default level like the level menu does
+        try:
+            return prefetch_level(self.levels_path, self.songs_path, self.levels[index], self.song_meta)
+        except Exception:
+            print("unable to load level " + self.levels[index] + ", using default")
+            self.played[index] = DEFAULT_LEVEL
+            return prefetch_level(self.levels_path, self.songs_path, DEFAULT_LEVEL, self.song_meta)
+
+    def prefetch(self, index):
+        if index < len(self.levels) and index not in self.prefetched:
+            self.prefetched[index] = self.loader.submit(self.load, index)
+
+    def restart(self):
+        # back to the first level, returns the Future of it
+        self.position = 0
+        self.results = []
+        self.prefetch(0)
+        self.prefetch(1)
+        return self.prefetched[0]
+
+    def record(self, points, counts):
+        # the current level has ended
+        result = {"level" : self.levels[self.position], "points" : points, "judgements" : dict(counts)}
+        if self.played[self.position] != self.levels[self.position]:
+            result["played"] = self.played[self.position]
+        self.results.append(result)
+
+    def finished(self):
+        return len(self.results) >= len(self.levels)
+
+    def ready(self):
+        # whether the next level can be switched to without waiting
+        if self.finished() or len(self.results) <= self.position:
+            return False
+        future = self.prefetched.get(self.position + 1)
+        return future is not None and future.done()
+
+    def advance(self):
+        # (song name, times, coords, song file) of the next level, which becomes the current one
+        self.position += 1
+        self.prefetch(self.position + 1)
+        song_name, times, coords, song_file = self.prefetched.pop(self.position).result()
+        return song_name, times, coords, None if song_file is None else io.BytesIO(song_file)
+
+    def summary(self):
+        counts = {judgement : 0 for judgement in JUDGEMENT_POINTS}
+        for result in self.results:
+            for judgement, count in result["judgements"].items():
+                counts[judgement] = counts.get(judgement, 0) + count
+        return {
+            "levels" : list(self.results),
+            "points" : sum(result["points"] for result in self.results),
+            "judgements" : counts
+        }
+
+    def close(self):
+        self.loader.shutdown(wait=False)
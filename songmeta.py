@@ -0,0 +1,199 @@
+"""
+Song metadata for Hand Dance.
+
+probe_length reads a song's length from its file headers (MP3 frame headers and Xing/VBRI tags, WAV and Ogg
+Vorbis headers). SongMetadata caches lengths on disk keyed by path, modification time and size, and looks
+up uncached ones on a background thread, length() is None until they are done.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import wave
+
+SONG_CACHE_PATH = "song_cache.json"
+
+# kbps by [version is MPEG1][layer]
+MP3_BITRATES = {
+    (True, 1) : [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2) : [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3) : [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1) : [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2) : [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3) : [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = [44100, 48000, 32000]
+# how far into the file to look for the first frame
+MP3_SYNC_SEARCH = 64 * 1024
+
+
+def parse_mp3_header(header):
+    # (bitrate bps, sample rate, samples per frame, mpeg1, mono) or None if this isn't a frame header
+    if len(header) < 4:
+        return None
+    value = struct.unpack(">I", header[:4])[0]
+    if value & 0xFFE00000 != 0xFFE00000:
+        return None
+    version = (value >> 19) & 3
+    layer = 4 - ((value >> 17) & 3)
+    bitrate_index = (value >> 12) & 15
+    sample_rate_index = (value >> 10) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    sample_rate = MP3_SAMPLE_RATES[sample_rate_index] >> (0 if mpeg1 else (1 if version == 2 else 2))
+    if layer == 1:
+        samples = 384
+    elif layer == 2 or mpeg1:
+        samples = 1152
+    else:
+        samples = 576
+    mono = (value >> 6) & 3 == 3
+    return MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000, sample_rate, samples, mpeg1, mono
+
+
+def probe_mp3(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        data = f.read(10)
+        audio_start = 0
+        if data[:3] == b"ID3" and len(data) == 10:
+            tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+            audio_start = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+        f.seek(audio_start)
+        data = f.read(MP3_SYNC_SEARCH)
+        f.seek(max(size - 128, 0))
+        has_id3v1 = f.read(3) == b"TAG"
+
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF:
+            continue
+        header = parse_mp3_header(data[offset:offset + 4])
+        if header is None:
+            continue
+        bitrate, sample_rate, samples, mpeg1, mono = header
+
+        # a Xing/Info or VBRI tag in the first frame holds the real frame count for VBR files
+        side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+        xing = offset + 4 + side_info
+        if data[xing:xing + 4] in (b"Xing", b"Info"):
+            flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+            if flags & 1:
+                frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+                return frames * samples / sample_rate
+        vbri = offset + 4 + 32
+        if data[vbri:vbri + 4] == b"VBRI":
+            frames = struct.unpack(">I", data[vbri + 14:vbri + 18])[0]
+            return frames * samples / sample_rate
+
+        audio_bytes = size - audio_start - offset - (128 if has_id3v1 else 0)
+        return audio_bytes * 8 / bitrate
+    raise ValueError("no mp3 frame found in " + path)
+
+
+def probe_wav(path):
+    with wave.open(path, "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+def probe_ogg(path):
+    # the last page's granule position is the total sample count, the rate is in the vorbis id header
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(4096)
+        f.seek(max(size - 65536, 0))
+        tail = f.read()
+    rate_at = head.find(b"\x01vorbis")
+    last_page = tail.rfind(b"OggS")
+    if rate_at < 0 or last_page < 0:
+        raise ValueError("not an ogg vorbis file: " + path)
+    sample_rate = struct.unpack("<I", head[rate_at + 12:rate_at + 16])[0]
+    granule = struct.unpack("<q", tail[last_page + 6:last_page + 14])[0]
+    return granule / sample_rate
+
+
+def probe_length(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".mp3":
+        return probe_mp3(path)
+    if extension == ".wav":
+        return probe_wav(path)
+    if extension == ".ogg":
+        return probe_ogg(path)
+    # anything else still has to be decoded
+    import pygame
+    return pygame.mixer.Sound(path).get_length()
+
+
+class SongMetadata:
+    def __init__(self, cache_path=SONG_CACHE_PATH):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        try:
+            with open(cache_path, "r") as f:
+                self.cache = json.load(f)
+        except (OSError, ValueError):
+            self.cache = {}
+        self.lengths = {}
+        self.pending = set()
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.probe_loop, name="hd-songmeta", daemon=True)
+        self.worker.start()
+
+    def cached_length(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.cache.get(os.path.abspath(path))
+        if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["length"]
+        return None
+
+    def lookup(self, path):
+        # blocking, probes the file if it isn't cached
+        with self.lock:
+            if path in self.lengths:
+                return self.lengths[path]
+            length = self.cached_length(path)
+        if length is None:
+            stat = os.stat(path)
+            length = probe_length(path)
+            with self.lock:
+                self.cache[os.path.abspath(path)] = {"mtime" : stat.st_mtime, "size" : stat.st_size, "length" : length}
+                self.save()
+        with self.lock:
+            self.lengths[path] = length
+        return length
+
+    def length(self, path):
+        # non-blocking, None until the length is known
+        with self.lock:
+            if path in self.lengths:
+                return self.lengths[path]
+            if path not in self.pending:
+                self.pending.add(path)
+                self.requests.put(path)
+        return None
+
+    def probe_loop(self):
+        while True:
+            path = self.requests.get()
+            try:
+                self.lookup(path)
+            except Exception:
+                print("unable to read song length of " + path)
+                with self.lock:
+                    self.lengths[path] = 0
+            with self.lock:
+                self.pending.discard(path)
+
+    def save(self):
+        try:
+            with open(self.cache_path, "w") as f:
+                json.dump(self.cache, f)
+        except OSError:
+            print("unable to write song cache")
@@ -0,0 +1,182 @@
+"""
+Pluggable frame, landmark and music sources for Hand Dance.
+
+main() normally reads the webcam through cv.VideoCapture, detects hands with MediaPipe and plays the song
+with pygame.mixer.music. Everything here has the same interface as the object it stands in for, so the game
+can be run without a camera, without MediaPipe and without audio:
+
+    frame sources       read() / release() like cv.VideoCapture
+    landmark sources    process(rgb_image) like mp.solutions.hands.Hands
+    SimulatedMusic      load() / play() / get_pos() / get_busy() ... like pygame.mixer.music
+
+All of them share a SimulatedClock that advances a fixed step for every frame read, which makes a replay
+deterministic regardless of how fast the machine running it is.
+"""
+
+import os
+from types import SimpleNamespace
+
+import cv2 as cv
+import numpy as np
+
+from levelfile import load_level
+from scheduler import spawn_times
+
+
+def use_headless_display():
+    # must be called before pygame opens the display or the mixer
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+
+class SimulatedClock:
+    def __init__(self, frame_ms=1000 / 30):
+        self.frame_ms = frame_ms
+        self.frame = 0
+
+    def now(self):
+        return int(self.frame * self.frame_ms)
+
+    def seconds(self):
+        # a time.perf_counter stand-in
+        return self.now() / 1000
+
+    def tick(self):
+        self.frame += 1
+
+
+class SimulatedMusic:
+    def __init__(self, clock, length_ms):
+        self.clock = clock
+        self.length_ms = length_ms
+        self.started_at = None
+        self.start_ms = 0
+
+    def load(self, path, namehint=""):
+        pass
+
+    def unload(self):
+        pass
+
+    def play(self, loops=0, start=0.0):
+        self.started_at = self.clock.now()
+        self.start_ms = int(start * 1000)
+
+    def stop(self):
+        self.started_at = None
+
+    def get_busy(self):
+        if self.started_at is None:
+            return False
+        return self.start_ms + self.clock.now() - self.started_at < self.length_ms
+
+    def get_pos(self):
+        # like pygame, milliseconds since play() rather than since the start of the song, -1 once it has ended
+        if not self.get_busy():
+            return -1
+        return self.clock.now() - self.started_at
+
+
+class SyntheticFrameSource:
+    def __init__(self, width, height, clock, frame_count=None):
+        self.width = width
+        self.height = height
+        self.clock = clock
+        self.frame_count = frame_count
+        self.frames_read = 0
+        # a fixed gradient that scrolls with the frame number, cheap but not constant
+        gradient = np.linspace(0, 255, width, dtype=np.float32)
+        self.pattern = np.repeat(np.tile(gradient, (height, 1))[..., np.newaxis], 3, axis=2).astype(np.uint8)
+
+    def read(self, image=None):
+        if self.frame_count is not None and self.frames_read >= self.frame_count:
+            return False, None
+        self.clock.tick()
+        self.frames_read += 1
+        return True, np.roll(self.pattern, self.frames_read * 4, axis=1)
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+
+class VideoFileSource:
+    def __init__(self, path, clock, loop=False):
+        self.path = path
+        self.clock = clock
+        self.loop = loop
+        self.capture = cv.VideoCapture(path)
+
+    def read(self, image=None):
+        ret, image = self.capture.read(image)
+        if not ret and self.loop:
+            self.capture.set(cv.CAP_PROP_POS_FRAMES, 0)
+            ret, image = self.capture.read(image)
+        if ret:
+            self.clock.tick()
+        return ret, image
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def release(self):
+        self.capture.release()
+
+
+def hand_results(hands, width, height):
+    # MediaPipe style results from [(label, 21 [x, y] pixel points)]
+    if len(hands) == 0:
+        return SimpleNamespace(multi_hand_landmarks=None, multi_handedness=None)
+    landmarks = []
+    handedness = []
+    for label, points in hands:
+        # pixel centres so calc_landmark_list maps them back to the same integers
+        landmarks.append(SimpleNamespace(landmark=[
+            SimpleNamespace(x=(x + 0.5) / width, y=(y + 0.5) / height, z=0.0) for x, y in np.asarray(points).tolist()
+        ]))
+        handedness.append(SimpleNamespace(classification=[SimpleNamespace(label=label, score=1.0)]))
+    return SimpleNamespace(multi_hand_landmarks=landmarks, multi_handedness=handedness)
+
+
+class LandmarkReplay:
+    """
+    Replays recorded poses as detected hands. Before the song starts it holds a hand over the start button,
+    after that it shows whichever recorded pose was most recently due.
+    """
+    def __init__(self, times, coords, music, width, height, start_coords):
+        self.times = spawn_times(times)
+        self.coords = coords
+        self.music = music
+        self.width = width
+        self.height = height
+        start_hand = np.zeros((21, 2), dtype=np.int32)
+        start_hand[:] = start_coords
+        self.start_results = hand_results([("Right", start_hand)], width, height)
+        self.results = self.start_results
+        self.frames = 0
+
+    @classmethod
+    def from_level(cls, path, music, width, height, start_coords):
+        _, times, coords = load_level(path)
+        return cls(times, coords, music, width, height, start_coords)
+
+    def pose(self, song_ms):
+        index = int(np.searchsorted(self.times, song_ms, side="left")) - 1
+        if index < 0:
+            return []
+        pose = self.coords[index]
+        if len(pose) == 2:
+            return [("Left", pose[0]), ("Right", pose[1])]
+        return [("Right", pose)]
+
+    def process(self, image):
+        self.frames += 1
+        # once the song has ended the hands stay in the last pose, so a recording sees get_pos() go to -1
+        if self.music.get_busy():
+            self.results = hand_results(self.pose(self.music.get_pos() + self.music.start_ms), self.width, self.height)
+        return self.results
+
+    def close(self):
+        pass
@@ -0,0 +1,114 @@
+"""
+Target sprites for Hand Dance.
+
+Each target hand is rasterized once into a mask cropped to its bounding box, and the pixels it covers are
+kept in an LRU cache keyed by its coordinates. Every frame the live targets are stacked into a reused layer
+on just those pixels and blended onto the camera image in a single pass, so the cost follows the pixels the
+targets cover rather than the number of targets times the frame size.
+"""
+
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+# same skeleton draw_landmarks uses: wrist to thumb, each finger's joints, and the palm outline
+HAND_CONNECTIONS = [(0, 1)]
+for finger in range(1, 18, 4):
+    HAND_CONNECTIONS += [(finger + joint, finger + joint + 1) for joint in range(3)]
+    HAND_CONNECTIONS.append((finger, (finger + 4) % 21))
+
+SPRITE_CACHE_SIZE = 1024
+
+
+def rasterize_hand(hand, thickness=2):
+    # (x, y, mask) where mask is the hand's coverage inside its bounding box
+    points = np.asarray(hand, dtype=np.int32).reshape(-1, 2)
+    pad = thickness
+    x0, y0 = points.min(axis=0) - pad
+    x1, y1 = points.max(axis=0) + pad + 1
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    local = points - (x0, y0)
+    for start, end in HAND_CONNECTIONS:
+        cv.line(mask, tuple(local[start].tolist()), tuple(local[end].tolist()), 255, thickness)
+    return int(x0), int(y0), mask
+
+
+def sprite_pixels(hand, width, height, thickness=2):
+    # flat index into a width x height image of every pixel the hand covers
+    x, y, mask = rasterize_hand(hand, thickness)
+    ys, xs = np.nonzero(mask)
+    ys += y
+    xs += x
+    inside = (ys >= 0) & (xs >= 0) & (ys < height) & (xs < width)
+    return ys[inside] * width + xs[inside]
+
+
+class SpriteCache:
+    def __init__(self, width, height, capacity=SPRITE_CACHE_SIZE, thickness=2):
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.thickness = thickness
+        self.sprites = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hand):
+        key = np.asarray(hand, dtype=np.int16).tobytes()
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+
+        self.misses += 1
+        sprite = sprite_pixels(hand, self.width, self.height, self.thickness)
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.capacity:
+            self.sprites.popitem(last=False)
+        return sprite
+
+
+class SpriteLayer:
+    def __init__(self, width, height, cache=None):
+        self.width = width
+        self.height = height
+        self.cache = SpriteCache(width, height) if cache is None else cache
+        # premultiplied colour and coverage, reused between frames and only cleared where drawn
+        self.color = np.zeros((height * width, 3), dtype=np.float32)
+        self.alpha = np.zeros(height * width, dtype=np.float32)
+        self.items = []
+
+    def add_hand(self, hand, transparency, color):
+        if transparency <= 0 or len(hand) == 0:
+            return
+        self.items.append((self.cache.get(hand), min(transparency, 1.0), color))
+
+    def add_pixels(self, index, transparency, color):
+        # pixels drawn elsewhere, with a transparency per pixel, see trails.py
+        if len(index) > 0:
+            self.items.append((index, np.minimum(transparency, 1.0), color))
+
+    def composite(self, image):
+        if len(self.items) == 0:
+            return image
+        image = np.ascontiguousarray(image)
+
+        # the pixels any target covers, rather than searching the whole frame for them, a pixel covered twice
+        # is just blended to the same value twice
+        touched = np.concatenate([index for index, _, _ in self.items])
+        # later targets are stacked over earlier ones, only on the pixels they cover
+        for index, transparency, color in self.items:
+            coverage = transparency if np.ndim(transparency) == 0 else transparency[:, np.newaxis]
+            self.color[index] = self.color[index] * (1 - coverage) + np.asarray(color, dtype=np.float32) * coverage
+            self.alpha[index] = self.alpha[index] * (1 - transparency) + transparency
+        self.items = []
+
+        # then blended onto the image once, every covered pixel has some coverage left in alpha
+        pixels = image.reshape(-1, 3)
+        blended = pixels[touched] * (1 - self.alpha[touched])[:, np.newaxis] + self.color[touched] + 0.5
+        pixels[touched] = blended
+        self.color[touched] = 0
+        self.alpha[touched] = 0
+        return image
@@ -0,0 +1,87 @@
+"""
+Startup for Hand Dance.
+
+StartupTasks runs each startup task (camera, hand model, sounds, first level) on its own thread while the
+window shows a loading screen with their progress, and measures the time to first frame and until
+everything is ready. MediaPipe is only imported inside the hand model task.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from assets import SoundBank
+
+# how long the loading screen waits for a task before drawing again
+LOADING_FRAME_MS = 33
+
+
+def load_sounds(sfx_path):
+    # pygame.mixer.init() has to have run on the main thread
+    return SoundBank(sfx_path)
+
+
+class StartupTasks:
+    def __init__(self, timer=time.perf_counter):
+        self.timer = timer
+        self.start_time = timer()
+        self.lock = threading.Lock()
+        # name -> Future, in the order they were added
+        self.tasks = {}
+        # name -> ms from start until the task finished
+        self.finished = {}
+        self.first_frame_ms = None
+        self.ready_ms = None
+
+    def elapsed_ms(self):
+        return (self.timer() - self.start_time) * 1000
+
+    def add(self, name, function, *args):
+        # runs function(*args) on its own thread, returns its Future
+        future = Future()
+        self.tasks[name] = future
+
+        def run():
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            with self.lock:
+                self.finished[name] = self.elapsed_ms()
+
+        threading.Thread(target=run, name="hd-startup-" + name, daemon=True).start()
+        return future
+
+    def result(self, name):
+        # waits for the task, raising whatever it raised
+        return self.tasks[name].result()
+
+    def done(self):
+        return all(future.done() for future in self.tasks.values())
+
+    def wait(self, timeout=LOADING_FRAME_MS / 1000):
+        # until any task finishes or timeout, so the loading screen redraws as soon as something changes
+        pending = [future for future in self.tasks.values() if not future.done()]
+        if len(pending) > 0:
+            wait(pending, timeout, return_when=FIRST_COMPLETED)
+
+    def progress(self):
+        # ((name, done), ...), hashable for the overlay cache
+        return tuple((name, future.done()) for name, future in self.tasks.items())
+
+    def first_frame(self):
+        if self.first_frame_ms is None:
+            self.first_frame_ms = self.elapsed_ms()
+
+    def ready(self):
+        if self.ready_ms is None:
+            self.ready_ms = self.elapsed_ms()
+
+    def stats(self):
+        with self.lock:
+            tasks = {name : round(ms, 1) for name, ms in self.finished.items()}
+        return {
+            "first_frame_ms" : None if self.first_frame_ms is None else round(self.first_frame_ms, 1),
+            "ready_ms" : None if self.ready_ms is None else round(self.ready_ms, 1),
+            "tasks" : tasks
+        }
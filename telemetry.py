@@ -0,0 +1,192 @@
+"""
+Session telemetry for Hand Dance.
+
+With the telemetry preference on, TelemetryRecorder logs every frame of a song: time, song position, the
+landmarks and handedness scores of both hands, how many targets were released and on screen, and the hit
+and miss decisions. Records go into a ring of RING_CHUNKS preallocated chunks of CHUNK_FRAMES records that
+a background thread writes out, and if the disk can't keep up the oldest unwritten chunk is dropped.
+
+A log (.hdtl) is a header, the session's settings as JSON and the raw records. telemetry_stream turns
+the records into a landmark stream for scoring.py:
+    python scoring.py --sessions telemetry/*.hdtl --explain
+"""
+
+import json
+import os
+import struct
+import threading
+from collections import deque
+
+import numpy as np
+
+from levelfile import LANDMARK_COUNT
+
+MAGIC = b"HDTL"
+VERSION = 1
+# magic, version, settings length
+HEADER = struct.Struct("<4sHI")
+TELEMETRY_EXTENSION = ".hdtl"
+TELEMETRY_PATH = "telemetry/"
+CHUNK_FRAMES = 256
+RING_CHUNKS = 8
+
+LEFT_HAND = 1
+RIGHT_HAND = 2
+# the frame the song ended on, only the hit test ran
+ENDED = 4
+JUDGEMENT_CODES = {None : 0, "perfect" : 1, "good" : 2}
+
+RECORD = np.dtype([
+    ("frame_ms", "<i4"),    # timer, from the start of the session
+    ("song_ms", "<i4"),     # releases targets
+    ("pose_ms", "<i4"),     # expires targets
+    ("hit_ms", "<i4"),      # grades the hit test
+    ("flags", "u1"),        # LEFT_HAND | RIGHT_HAND | ENDED
+    ("judgement", "u1"),    # JUDGEMENT_CODES of the hit this frame
+    ("misses", "u1"),       # targets expired this frame
+    ("scores", "<f2", (2,)),   # handedness confidence, left and right
+    ("landmarks", "<i2", (2, LANDMARK_COUNT, 2)),  # pixels, left and right
+    ("released", "<u4"),    # targets released so far
+    ("live", "<u2")         # targets on screen after this frame
+])
+
+
+def telemetry_name(level_name, stamp):
+    return os.path.splitext(level_name)[0] + "-" + stamp + TELEMETRY_EXTENSION
+
+
+class TelemetryRecorder:
+    def __init__(self, path, settings, chunk_frames=CHUNK_FRAMES, chunks=RING_CHUNKS):
+        self.path = path
+        self.ring = np.zeros((max(chunks, 3), chunk_frames), dtype=RECORD)
+        self.current = 0
+        self.count = 0
+        self.free = deque(range(1, len(self.ring)))
+        # (chunk, frames) waiting for the writer
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.running = True
+        self.frames = 0
+        self.dropped = 0
+        self.start_ms = None
+        settings_bytes = json.dumps(settings).encode("utf-8")
+        self.header = HEADER.pack(MAGIC, VERSION, len(settings_bytes)) + settings_bytes
+        self.writer = threading.Thread(target=self.write_loop, name="hd-telemetry", daemon=True)
+        self.writer.start()
+
+    def add(self, frame_ms, song_ms, pose_ms, hit_ms, left_hand, right_hand, scores, released, live,
+            judgement=None, misses=0, ended=False):
+        if self.start_ms is None:
+            self.start_ms = frame_ms
+        record = self.ring[self.current, self.count]
+        record["frame_ms"] = frame_ms - self.start_ms
+        record["song_ms"] = song_ms
+        record["pose_ms"] = pose_ms
+        record["hit_ms"] = hit_ms
+        flags = ENDED if ended else 0
+        if len(left_hand) > 0:
+            flags |= LEFT_HAND
+            record["landmarks"][0] = left_hand
+        if len(right_hand) > 0:
+            flags |= RIGHT_HAND
+            record["landmarks"][1] = right_hand
+        record["flags"] = flags
+        record["scores"] = scores
+        record["judgement"] = JUDGEMENT_CODES.get(judgement, 0)
+        record["misses"] = min(misses, 255)
+        record["released"] = released
+        record["live"] = live
+        self.frames += 1
+        self.count += 1
+        if self.count == self.ring.shape[1]:
+            self.spill()
+
+    def spill(self):
+        with self.cond:
+            if self.count > 0:
+                self.pending.append((self.current, self.count))
+            if len(self.free) > 0:
+                self.current = self.free.popleft()
+            elif len(self.pending) > 1:
+                # the writer is behind, the oldest chunk it hasn't started on is lost
+                self.current, frames = self.pending.popleft()
+                self.dropped += frames
+                self.ring[self.current] = 0
+            else:
+                self.pending.pop()
+                self.dropped += self.count
+            self.count = 0
+            self.cond.notify_all()
+
+    def write_loop(self):
+        try:
+            f = open(self.path, "wb")
+        except OSError:
+            print("unable to write telemetry to " + self.path)
+            f = None
+        try:
+            if f is not None:
+                f.write(self.header)
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: len(self.pending) > 0 or not self.running)
+                    if len(self.pending) == 0:
+                        return
+                    chunk, frames = self.pending.popleft()
+                if f is not None:
+                    f.write(self.ring[chunk, :frames].tobytes())
+                    f.flush()
+                with self.cond:
+                    self.ring[chunk] = 0
+                    self.free.append(chunk)
+        except OSError:
+            print("unable to write telemetry to " + self.path)
+        finally:
+            if f is not None:
+                f.close()
+
+    def close(self):
+        self.spill()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.writer.join()
+
+    def stats(self):
+        with self.cond:
+            return {"frames" : self.frames, "dropped" : self.dropped, "pending" : len(self.pending)}
+
+
+def read_telemetry(path):
+    # (settings, records), a record cut short by a crash is ignored
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, settings_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(path + " is not a telemetry log")
+    offset = HEADER.size
+    settings = json.loads(data[offset:offset + settings_length].decode("utf-8"))
+    offset += settings_length
+    count = (len(data) - offset) // RECORD.itemsize
+    return settings, np.frombuffer(data, dtype=RECORD, count=count, offset=offset)
+
+
+def telemetry_stream(records, start_ms=0):
+    # a landmark stream for scoring.score_stream, start_ms is where in the song the session started
+    song_ms = records["song_ms"].astype(np.int64)
+    pose_ms = records["pose_ms"].astype(np.int64)
+    # nothing is released or expired on the frame the song ended on
+    ended = np.flatnonzero(records["flags"] & ENDED)
+    ended = ended[ended > 0]
+    song_ms[ended] = song_ms[ended - 1]
+    pose_ms[ended] = pose_ms[ended - 1]
+    return {
+        "song_ms" : song_ms,
+        "pose_ms" : pose_ms,
+        "hit_ms" : records["hit_ms"].astype(np.int64),
+        "left" : records["landmarks"][:, 0].copy(),
+        "right" : records["landmarks"][:, 1].copy(),
+        "has_left" : (records["flags"] & LEFT_HAND) > 0,
+        "has_right" : (records["flags"] & RIGHT_HAND) > 0,
+        "start_ms" : np.array(start_ms)
+    }
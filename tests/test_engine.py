@@ -0,0 +1,156 @@
+"""
+Tests for GameEngine.update(), run with python -m unittest discover tests (or pytest) from the top folder.
+"""
+
+import unittest
+
+import numpy as np
+
+from engine import (CALIBRATE, CALIBRATED, CALIBRATION_MODE, END, ENDED_MODE, KEY_FRAMES, LEVEL_SELECT,
+                    LEVEL_SELECT_MODE, LOAD, LOADING_MODE, NAMING_MODE, PLAYING_MODE, RECORD, RECORD_TWO_HANDS,
+                    SEEK_BACK, SEEK_FORWARD, SETTINGS, SETTINGS_MODE, SKIP, START, START_MODE, SUBMIT, GameEngine)
+from hitmatch import HandMatcher
+from judgement import PERFECT
+
+
+def pose(x, y):
+    # a one-handed pose with every landmark at (x, y)
+    return np.full((21, 2), (x, y)).tolist()
+
+
+def make_engine(times=(1000, 2000, 3000), hit_window=300):
+    coords = [pose(100 * (i + 1), 100) for i in range(len(times))]
+    return GameEngine(list(times), coords, hit_window, HandMatcher(30)), coords
+
+
+class PlayTest(unittest.TestCase):
+    def test_hits_the_target_the_hands_match(self):
+        engine, coords = make_engine()
+        engine.update(0, None, {START})
+        judgement, misses = engine.update(1010, ([], coords[0], 1010))
+        self.assertEqual(judgement, PERFECT)
+        self.assertEqual(misses, 0)
+        self.assertEqual(engine.snapshot().points, 100)
+
+    def test_hands_that_press_start_are_not_judged(self):
+        engine, coords = make_engine(times=(0,))
+        judgement, _ = engine.update(0, ([], coords[0], 0), {START})
+        self.assertIsNone(judgement)
+        self.assertEqual(engine.mode, PLAYING_MODE)
+
+    def test_targets_expire_as_misses(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {START})
+        _, misses = engine.update(2500)
+        self.assertEqual(misses, 2)
+        self.assertEqual(engine.snapshot().counts["miss"], 2)
+
+    def test_update_rate_does_not_change_the_result(self):
+        # the miss of the first target comes before the hit of the second however often update() is called
+        results = []
+        for frame_ms in (1, 7, 33, 500, 2010):
+            engine, coords = make_engine()
+            engine.update(0, None, {START})
+            for now_ms in range(frame_ms, 2010, frame_ms):
+                engine.update(now_ms)
+            engine.update(2010, ([], coords[1], 2010))
+            state = engine.snapshot()
+            results.append((state.points, state.combo, state.counts))
+        self.assertEqual(results, [(100, 1, {"perfect" : 1, "good" : 0, "miss" : 1})] * 5)
+
+    def test_end_stops_releasing_and_missing(self):
+        engine, coords = make_engine()
+        engine.update(0, None, {START})
+        engine.update(1010)
+        judgement, _ = engine.update(1020, ([], coords[0], 1020), {END})
+        self.assertEqual(judgement, PERFECT)
+        self.assertEqual(engine.mode, ENDED_MODE)
+        _, misses = engine.update(5000)
+        self.assertEqual(misses, 0)
+        self.assertEqual(engine.snapshot().targets, ())
+
+
+class MenuTest(unittest.TestCase):
+    def test_settings_prompts(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {SETTINGS})
+        self.assertEqual(engine.mode, SETTINGS_MODE)
+        self.assertTrue(engine.typing)
+        engine.update(0, None, {(SUBMIT, "500")})
+        engine.update(0, None, {(SUBMIT, "")})
+        self.assertEqual(engine.snapshot().prompt, 2)
+        engine.update(0, None, {(SUBMIT, "y")})
+        self.assertEqual(engine.hit_window, 500)
+        self.assertEqual(engine.matcher.tolerance, 30)
+        self.assertTrue(engine.no_camera)
+        self.assertEqual(engine.mode, START_MODE)
+        self.assertFalse(engine.typing)
+
+    def test_naming_a_take(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {RECORD_TWO_HANDS})
+        self.assertEqual((engine.mode, engine.recording), (NAMING_MODE, 2))
+        engine.update(0, None, {(SUBMIT, "song.mp3")})
+        engine.update(0, None, {(SUBMIT, "take")})
+        self.assertEqual(engine.mode, START_MODE)
+        # a take has nothing to hit, and the settings are only for playing back
+        engine.update(0, None, {SETTINGS})
+        self.assertEqual(engine.mode, START_MODE)
+        engine.update(0, None, {START})
+        _, misses = engine.update(5000)
+        self.assertEqual((engine.mode, misses), (PLAYING_MODE, 0))
+
+    def test_skip_stops_naming(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {RECORD})
+        engine.update(0, None, {(SUBMIT, "missing.mp3"), SKIP})
+        self.assertEqual((engine.mode, engine.recording, engine.prompt), (START_MODE, 1, 0))
+
+    def test_level_select_and_loading(self):
+        engine, coords = make_engine()
+        engine.update(0, None, {LEVEL_SELECT})
+        self.assertEqual(engine.mode, LEVEL_SELECT_MODE)
+        engine.update(0, None, {LEVEL_SELECT})
+        self.assertEqual(engine.mode, START_MODE)
+        engine.update(0, None, {LEVEL_SELECT})
+        engine.update(0, None, {LOAD})
+        self.assertEqual(engine.mode, LOADING_MODE)
+        engine.reset([500], coords[:1])
+        self.assertEqual(engine.mode, START_MODE)
+
+    def test_calibration(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {CALIBRATE})
+        self.assertEqual(engine.mode, CALIBRATION_MODE)
+        engine.update(0, None, {CALIBRATED})
+        self.assertEqual(engine.mode, START_MODE)
+        # key frame mode replays the level, it can't be calibrated from
+        engine.update(0, None, {KEY_FRAMES})
+        engine.update(0, None, {CALIBRATE})
+        self.assertEqual(engine.mode, START_MODE)
+        self.assertTrue(engine.key_frames)
+
+    def test_seek(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {SEEK_FORWARD})
+        engine.update(0, None, {SEEK_FORWARD})
+        engine.update(0, None, {SEEK_BACK})
+        self.assertEqual(engine.start_ms, 5000)
+        engine.update(0, None, {SEEK_BACK, SEEK_FORWARD})
+        self.assertEqual(engine.start_ms, 5000)
+
+    def test_menus_are_ignored_while_playing(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {START})
+        engine.update(100, None, {SETTINGS, RECORD, LEVEL_SELECT, CALIBRATE})
+        self.assertEqual((engine.mode, engine.recording), (PLAYING_MODE, 0))
+
+    def test_reset_drops_the_take(self):
+        engine, _ = make_engine()
+        engine.update(0, None, {RECORD})
+        engine.reset([], [])
+        self.assertEqual((engine.mode, engine.recording, engine.typing), (START_MODE, 0, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+"""
+Adaptive hand tracking for Hand Dance.
+
+AdaptiveHands wraps a MediaPipe Hands object (or anything with the same process() method) and only runs
+it on every Nth frame. In between, the 21 landmarks of each hand are predicted by a constant-velocity
+alpha-beta filter and returned as MediaPipe-style results.
+
+N is the smallest stride that keeps the frame inside a time budget, from the measured cost of inference
+and of the rest of the frame. Time the caller spent waiting for the camera, reported with wait(), isn't
+counted. Detection can run on a downscaled frame and, while every hand is tracked, on a crop around where
+the hands are predicted to be.
+"""
+
+import math
+import time
+from types import SimpleNamespace
+
+import cv2 as cv
+import numpy as np
+
+# target frame time, 30 fps
+FRAME_BUDGET_MS = 1000 / 30
+MAX_STRIDE = 4
+# filter gains, position follows a detection almost entirely, velocity is smoothed over a few detections
+FILTER_ALPHA = 0.85
+FILTER_BETA = 0.4
+# predictions further ahead than this are held in place instead of extrapolated
+MAX_PREDICT_MS = 150
+# a hand that hasn't been detected for this long is dropped
+LOST_MS = 300
+# the crop is the hands' bounding box grown by this fraction of its size on every side
+ROI_MARGIN = 0.5
+# smallest crop, as a fraction of the frame
+ROI_MIN_SIZE = 0.3
+# every so often the whole frame is searched so a hand entering the picture is found
+FULL_FRAME_EVERY = 10
+# smoothing of the measured costs
+COST_SMOOTHING = 0.1
+
+
+class TrackedHand:
+    def __init__(self, label, score, points, now):
+        self.label = label
+        self.score = score
+        # normalized x, y, z per landmark
+        self.points = points
+        self.velocity = np.zeros_like(points)
+        self.updated = now
+
+    def predict(self, now):
+        dt = min(now - self.updated, MAX_PREDICT_MS)
+        return self.points + self.velocity * dt
+
+    def correct(self, points, score, now):
+        dt = now - self.updated
+        if dt <= 0:
+            self.points = points
+        else:
+            predicted = self.predict(now)
+            residual = points - predicted
+            self.points = predicted + FILTER_ALPHA * residual
+            self.velocity = self.velocity + FILTER_BETA * residual / dt
+        self.score = score
+        self.updated = now
+
+
+def hand_points(hand_landmarks):
+    return np.array([(landmark.x, landmark.y, landmark.z) for landmark in hand_landmarks.landmark], dtype=np.float32)
+
+
+def tracked_results(hands):
+    # MediaPipe style results from [(label, score, 21 normalized [x, y, z] points)]
+    if len(hands) == 0:
+        return SimpleNamespace(multi_hand_landmarks=None, multi_handedness=None)
+    landmarks = []
+    handedness = []
+    for label, score, points in hands:
+        landmarks.append(SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z) for x, y, z in points.tolist()]))
+        handedness.append(SimpleNamespace(classification=[SimpleNamespace(label=label, score=score)]))
+    return SimpleNamespace(multi_hand_landmarks=landmarks, multi_handedness=handedness)
+
+
+class AdaptiveHands:
+    def __init__(self, hands, budget_ms=FRAME_BUDGET_MS, max_stride=MAX_STRIDE, scale=1.0, roi=True, clock=None):
+        self.hands = hands
+        self.budget_ms = budget_ms
+        self.max_stride = max_stride
+        self.scale = scale
+        self.roi = roi
+        # milliseconds, only used to time the filter so a simulated clock makes prediction deterministic
+        self.clock = clock if clock is not None else lambda: time.perf_counter() * 1000
+        self.tracked = {}
+        self.stride = 1
+        self.since_detection = 0
+        self.since_full_frame = 0
+        self.full_frame = True
+        self.inference_ms = 0.0
+        self.other_ms = 0.0
+        self.last_return = None
+        # waiting for frames since the last process(), see wait()
+        self.waited_ms = 0.0
+        self.detections = 0
+        self.predictions = 0
+
+    def wait(self, ms):
+        # time since the last process() spent blocked on the camera, a camera bound frame isn't a costly one
+        self.waited_ms += ms
+
+    def process(self, image):
+        start = time.perf_counter()
+        if self.last_return is not None:
+            # everything the game did since the last call
+            other_ms = max((start - self.last_return) * 1000 - self.waited_ms, 0)
+            self.other_ms += COST_SMOOTHING * (other_ms - self.other_ms)
+        self.waited_ms = 0.0
+        now = self.clock()
+
+        self.since_detection += 1
+        if self.since_detection >= self.stride or self.full_frame or len(self.tracked) == 0:
+            self.detect(image, now)
+            self.since_detection = 0
+            self.detections += 1
+            self.inference_ms += COST_SMOOTHING * ((time.perf_counter() - start) * 1000 - self.inference_ms)
+            self.adjust_stride()
+        else:
+            self.predictions += 1
+
+        hands = []
+        for label, hand in list(self.tracked.items()):
+            if now - hand.updated > LOST_MS:
+                del self.tracked[label]
+            else:
+                hands.append((label, hand.score, hand.predict(now)))
+        results = tracked_results(hands)
+        self.last_return = time.perf_counter()
+        return results
+
+    def adjust_stride(self):
+        # smallest N with other + inference / N inside the budget
+        spare = self.budget_ms - self.other_ms
+        if spare <= 0:
+            self.stride = self.max_stride
+        else:
+            self.stride = min(max(math.ceil(self.inference_ms / spare), 1), self.max_stride)
+
+    def crop(self, image, now):
+        # pixel box around where the tracked hands should be now, None for the whole frame
+        height, width = image.shape[:2]
+        points = np.concatenate([hand.predict(now)[:, :2] for hand in self.tracked.values()])
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        margin_x = max((x1 - x0) * ROI_MARGIN, (ROI_MIN_SIZE - (x1 - x0)) / 2)
+        margin_y = max((y1 - y0) * ROI_MARGIN, (ROI_MIN_SIZE - (y1 - y0)) / 2)
+        x0, x1 = max(int((x0 - margin_x) * width), 0), min(int(math.ceil((x1 + margin_x) * width)), width)
+        y0, y1 = max(int((y0 - margin_y) * height), 0), min(int(math.ceil((y1 + margin_y) * height)), height)
+        if x1 - x0 >= width and y1 - y0 >= height:
+            return None
+        return x0, y0, x1, y1
+
+    def detect(self, image, now):
+        height, width = image.shape[:2]
+        box = None
+        if self.roi and not self.full_frame and self.since_full_frame < FULL_FRAME_EVERY and len(self.tracked) > 0:
+            box = self.crop(image, now)
+        if box is None:
+            x0, y0, x1, y1 = 0, 0, width, height
+            self.since_full_frame = 0
+        else:
+            x0, y0, x1, y1 = box
+            self.since_full_frame += 1
+            image = image[y0:y1, x0:x1]
+        if self.scale != 1.0:
+            image = cv.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv.INTER_AREA)
+
+        results = self.hands.process(image)
+        found = set()
+        if results.multi_hand_landmarks is not None:
+            for hand_landmarks, handedness in zip(results.multi_hand_landmarks, results.multi_handedness):
+                classification = handedness.classification[0]
+                points = hand_points(hand_landmarks)
+                # back from the crop to the whole frame
+                points[:, 0] = (points[:, 0] * (x1 - x0) + x0) / width
+                points[:, 1] = (points[:, 1] * (y1 - y0) + y0) / height
+                if classification.label in self.tracked:
+                    self.tracked[classification.label].correct(points, classification.score, now)
+                else:
+                    self.tracked[classification.label] = TrackedHand(classification.label, classification.score, points, now)
+                found.add(classification.label)
+
+        if box is None:
+            # the whole frame was searched, hands it didn't find are gone
+            for label in list(self.tracked):
+                if label not in found:
+                    del self.tracked[label]
+            self.full_frame = False
+        elif len(found) < len(self.tracked):
+            # a hand left the crop, look at the whole frame next time
+            self.full_frame = True
+
+    def stats(self):
+        return {
+            "stride" : self.stride,
+            "detections" : self.detections,
+            "predictions" : self.predictions,
+            "inference_ms" : round(self.inference_ms, 2),
+            "other_ms" : round(self.other_ms, 2)
+        }
+
+    def close(self):
+        self.hands.close()
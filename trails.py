@@ -0,0 +1,154 @@
+"""
+Level of detail target rendering for Hand Dance.
+
+TargetRenderer draws the target due next as a full skeleton and merges runs of targets that follow each
+other within a time window into a trail: the fingertips' paths through those poses, fading with the
+targets, rasterized with one cv.polylines call per fade step and blended with the skeletons in
+SpriteLayer's single pass. A target with no neighbour inside the window is drawn as a skeleton.
+
+adjust() takes each frame's cost without the camera wait. Over budget, the trails merge over longer
+windows, trace fewer fingertips and use fewer fade steps. Under DETAIL_HEADROOM of it, detail comes back.
+"""
+
+import cv2 as cv
+import numpy as np
+
+from hitmatch import FINGERTIPS
+from sprites import SpriteLayer
+from tracking import COST_SMOOTHING, FRAME_BUDGET_MS
+
+TRAIL_WINDOW_MS = 150
+# (merge window ms, fingertips traced, fade steps), most detailed first
+DETAIL_LEVELS = (
+    (TRAIL_WINDOW_MS, FINGERTIPS, 8),
+    (TRAIL_WINDOW_MS * 2, FINGERTIPS, 4),
+    (TRAIL_WINDOW_MS * 4, (4, 8), 2)
+)
+# detail comes back when frames take less than this share of the budget
+DETAIL_HEADROOM = 0.75
+# frames between detail changes
+DETAIL_HOLD_FRAMES = 30
+TRAIL_THICKNESS = 2
+
+
+def target_color(index, two_handed):
+    if two_handed:
+        return (255, 255 - ((index * 25) % 250), 0)
+    return (255, 0, 0)
+
+
+def group_targets(target_times, window_ms):
+    # [(first, last)] index ranges of targets that each follow the one before within window_ms
+    groups = []
+    first = 0
+    for i in range(1, len(target_times) + 1):
+        if i == len(target_times) or target_times[i] - target_times[i - 1] > window_ms:
+            groups.append((first, i - 1))
+            first = i
+    return groups
+
+
+def trail_segments(targets, first, last, fingertips):
+    # (segment start and end points, fade) of every fingertip's path from target first to target last
+    hands = [np.asarray(coords, dtype=np.int32).reshape(-1, 21, 2) for coords, _ in targets[first:last + 1]]
+    fades = np.array([fade for _, fade in targets[first:last + 1]], dtype=np.float32)
+    # poses x hands x fingertips x 2
+    tips = np.stack(hands)[:, :, list(fingertips)]
+    segments = np.stack([tips[:-1], tips[1:]], axis=-2).reshape(len(hands) - 1, -1, 2, 2)
+    # a segment fades with the two targets it joins
+    segment_fades = np.repeat((fades[:-1] + fades[1:]) / 2, segments.shape[1])
+    return segments.reshape(-1, 2, 2), segment_fades
+
+
+class TargetRenderer:
+    def __init__(self, width, height, budget_ms=FRAME_BUDGET_MS, layer=None):
+        self.width = width
+        self.height = height
+        self.budget_ms = budget_ms
+        self.layer = SpriteLayer(width, height) if layer is None else layer
+        self.detail = 0
+        self.held = 0
+        # smoothed cost of a frame
+        self.frame_ms = None
+        self.trails = 0
+        self.skeletons = 0
+
+    def draw(self, image, targets, target_times, song_ms):
+        # targets are ((coords, fade), ...) oldest first, target_times when each is due
+        if len(targets) == 0:
+            return image
+        window_ms, fingertips, steps = DETAIL_LEVELS[self.detail]
+        two_handed = len(targets[0][0]) == 2
+        # the target due next, the one closest to its time
+        due = int(np.argmin(np.abs(np.asarray(target_times, dtype=np.float64) - song_ms)))
+
+        segments = []
+        fades = []
+        skeletons = []
+        for first, last in group_targets(target_times, window_ms):
+            if first == last:
+                skeletons.append(first)
+                continue
+            points, segment_fades = trail_segments(targets, first, last, fingertips)
+            segments.append(points)
+            fades.append(segment_fades)
+            if first <= due <= last:
+                skeletons.append(due)
+        if len(segments) > 0:
+            self.add_trails(np.concatenate(segments), np.concatenate(fades), steps, target_color(0, two_handed))
+
+        # skeletons go over the trails
+        for i in skeletons:
+            coords, fade = targets[i]
+            if two_handed:
+                self.layer.add_hand(coords[0], fade, target_color(i, True))
+                self.layer.add_hand(coords[1], fade, target_color(i, True))
+            else:
+                self.layer.add_hand(coords, fade, target_color(i, False))
+        self.trails += len(segments)
+        self.skeletons += len(skeletons)
+        # all targets are blended in one pass, see sprites.py
+        return self.layer.composite(image)
+
+    def add_trails(self, segments, fades, steps, color):
+        # every segment is rasterized as a fade value into a canvas around them, one cv.polylines call per fade step
+        x0, y0 = segments.reshape(-1, 2).min(axis=0) - TRAIL_THICKNESS
+        x1, y1 = segments.reshape(-1, 2).max(axis=0) + TRAIL_THICKNESS + 1
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), self.width), min(int(y1), self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        canvas = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        local = segments - (x0, y0)
+        # brighter steps last so they are on top
+        bands = np.ceil(np.clip(fades, 0, 1) * steps).astype(np.int32)
+        for band in range(1, steps + 1):
+            chosen = local[bands == band]
+            if len(chosen) > 0:
+                cv.polylines(canvas, list(chosen), False, int(255 * band / steps), TRAIL_THICKNESS)
+        ys, xs = np.nonzero(canvas)
+        transparency = canvas[ys, xs].astype(np.float32) / 255
+        self.layer.add_pixels((ys + y0) * self.width + xs + x0, transparency, color)
+
+    def adjust(self, frame_ms):
+        # cost of the last frame, the detail level moves one step at a time towards the budget
+        if frame_ms is None:
+            return
+        self.frame_ms = frame_ms if self.frame_ms is None else self.frame_ms + COST_SMOOTHING * (frame_ms - self.frame_ms)
+        self.held += 1
+        if self.held < DETAIL_HOLD_FRAMES:
+            return
+        if self.frame_ms > self.budget_ms and self.detail < len(DETAIL_LEVELS) - 1:
+            self.detail += 1
+            self.held = 0
+        elif self.frame_ms < self.budget_ms * DETAIL_HEADROOM and self.detail > 0:
+            self.detail -= 1
+            self.held = 0
+
+    def stats(self):
+        return {
+            "detail" : self.detail,
+            "frame_ms" : None if self.frame_ms is None else round(self.frame_ms, 2),
+            "trails" : self.trails,
+            "skeletons" : self.skeletons
+        }